@@ -5,18 +5,63 @@
 # if both batteries work. Inserting 2 batteries at a time is therefore your only
 # way to test them. How many times must you insert different batteries to
 # guarantee the flashlight turns on?
+#
+# The same goes for devices taking 3 or more batteries (--size), where each
+# test is written as all the batteries inserted together, e.g. 'ABC'.
 
 
-from argparse import ArgumentParser
+import csv
+import json
+import os
+import random
+import sqlite3
+import sys
+from argparse import ArgumentParser, FileType
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from itertools import combinations
-from math import inf
-from statistics import mean, median, mode, stdev
+from hashlib import sha256
+from itertools import combinations, islice
+from math import comb, exp, inf, nan, sqrt
+from pathlib import Path
+from statistics import NormalDist
 from string import ascii_uppercase
 
+import profiler
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
 
 CUSTOM_NAME = 'CUSTOM'
+OPTIMAL_NAME = 'OPTIMAL'
+ADAPTIVE_NAME = 'ADAPTIVE'
+ANNEALED_NAME = 'ANNEALED'
+
+# how many good-subsets to evaluate per vectorized batch
+CHUNK = 1 << 20
+
+# good-sets are int64 masks when analyzed exactly; --estimate has no limit
+MAX_BATTERIES = 62
+
+# how many failed good-subsets to name before just counting them
+FAILED_SHOWN = 20
+
+# how many good-subsets each worker samples per round of --estimate
+SAMPLE_BATCH = 1 << 14
+
+# how many --file lines to analyze at a time before writing their rows
+BULK_BATCH = 1024
+
+# bump whenever Solution.summary() would change for the same inputs
+CACHE_VERSION = 2
+DEFAULT_CACHE = (
+  Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache')
+  / 'puzzles'
+  / 'batteries.sqlite'
+)
 
 SOLUTIONS = {
 
@@ -70,12 +115,103 @@ SOLUTIONS = {
 }
 
 
-def main(detail=False, solution=None, name=CUSTOM_NAME, verbose=False):
+def main(
+  detail=False,
+  solution=None,
+  name=CUSTOM_NAME,
+  verbose=False,
+  batteries=8,
+  good=4,
+  size=2,
+  optimize=False,
+  adaptive=None,
+  jobs=None,
+  cache=DEFAULT_CACHE,
+  file=None,
+  fmt='jsonl',
+  output=sys.stdout,
+  trie=False,
+  anneal=0,
+  restarts=4,
+  seed=None,
+  estimate=False,
+  tolerance=0.01,
+  confidence=0.95,
+  max_samples=10 ** 7,
+):
+
+  if file:
+    bulk(
+      file,
+      output,
+      fmt,
+      batteries,
+      good,
+      jobs,
+      cache and ResultCache.open(cache),
+      trie,
+      size,
+    )
+    return
 
+  # the built-in solutions are written for 8 batteries and 2 per test
+  solutions = {
+    name: test_order
+    for (name, test_order) in SOLUTIONS.items()
+    if fits(test_order, batteries, size)
+  }
   if solution:
-    SOLUTIONS[name] = solution
+    form = canonical(solution, batteries)[0]
+    for (other, test_order) in solutions.items():
+      if canonical(test_order, batteries)[0] == form:
+        print(f'{name} is the same strategy as {other}')
+    solutions[name] = solution
+  if optimize:
+    search = WorstCaseSearch(batteries, good, size)
+    if (best := search.run()) is None:
+      print(f'no test order can guarantee {good} of {batteries} light')
+    else:
+      print(
+        f'optimal worst case is {len(best)} tests'
+        f' (searched {search.nodes} nodes): ' + ','.join(best)
+      )
+      solutions[OPTIMAL_NAME] = best
+  if adaptive:
+    search = AdaptiveSearch(batteries, good, adaptive, size)
+    if (best := search.run()) is None:
+      print(f'no strategy can guarantee {good} of {batteries} light')
+    else:
+      # the other figure is just that strategy's, not an optimum of its own
+      (optimum, other) = (
+        (f'mean is {best[1]:.2f}', f'its worst {best[0]}')
+        if adaptive == 'mean' else
+        (f'worst case is {best[0]}', f'its mean {best[1]:.2f}')
+      )
+      print(
+        f'optimal adaptive {optimum} ({other},'
+        f' {len(search.table)} states): ' + ','.join(best[2])
+      )
+      solutions[ADAPTIVE_NAME] = best[2]
+  if anneal:
+    (total, order) = anneal_all(
+      batteries, good, anneal, restarts, jobs, seed, size
+    )
+    if total is None:
+      print(f'no order can guarantee {good} of {batteries} light')
+    else:
+      print(
+        f'annealed mean is {total / comb(batteries, good):.2f}'
+        f' (best of {restarts} x {anneal} steps): ' + ','.join(order)
+      )
+      solutions[ANNEALED_NAME] = order
+  if not solutions:
+    print(
+      f'no solutions use only the first {batteries} batteries'
+      f' and {size} per test'
+    )
+    return
 
-  max_name_len = len(max(SOLUTIONS, key=len))
+  max_name_len = len(max(solutions, key=len))
   print(max_name_len * ' ' + ' | ' + Solution.HEADER)
   print(
     max_name_len * '-'
@@ -83,41 +219,57 @@ def main(detail=False, solution=None, name=CUSTOM_NAME, verbose=False):
     + '-+-'.join(width * '-' for width in Solution.COLUMNS.values())
   )
 
+  # per-trial results for --verbose aren't cached, so analyze those here
+  if estimate:
+    analyzed = {}
+    for (name, algorithm) in solutions.items():
+      analyzed[name] = Solution(name, algorithm, batteries, good)
+      analyzed[name].estimate(tolerance, confidence, max_samples, jobs, seed)
+  elif verbose:
+    analyzed = {
+      name: Solution(name, algorithm, batteries, good, record=True)
+      for (name, algorithm) in solutions.items()
+    }
+  else:
+    analyzed = analyze_all(
+      solutions,
+      batteries,
+      good,
+      jobs,
+      cache and ResultCache.open(cache),
+    )
+
   name_fmt = f'{{:<{max_name_len}}} | '
-  for (name, algorithm) in SOLUTIONS.items():
+  for (name, algorithm) in solutions.items():
     print(name_fmt.format(name), end='')
-    solution = Solution(name, algorithm)
-    solution.analyze()
+    solution = analyzed[name]
     solution.explain(
       header=False,
       measure_names=False,
       detail=detail,
       verbose=verbose,
     )
+    if adaptive:
+      (worst, avg) = search.evaluate(algorithm)
+      print(f'    SKIPPING DEAD TESTS: worst={worst:.0f} mean={avg:.2f}')
 
 
 @dataclass
 class Battery:
   name: str
-  good: bool = False
-
-  def __bool__(self):
-
-    return self.good
+  bit: int = 0
 
 
 @dataclass
-class Pair:
-  batt1: Battery
-  batt2: Battery
+class Test:
+  batts: tuple
 
   def __post_init__(self):
 
-    self.name = ''.join(sorted([self.batt1.name, self.batt2.name]))
-
-  def __bool__(self):
-
-    return bool(self.batt1 and self.batt2)
+    self.name = ''.join(sorted(batt.name for batt in self.batts))
+    self.mask = 0
+    for batt in self.batts:
+      self.mask |= batt.bit
 
 
 class Solution:
@@ -134,42 +286,253 @@ class Solution:
     for (col, width) in COLUMNS.items()
   )
 
-  def __init__(self, name, test_order, batteries=8, good=4):
+  # tests are usually strings like 'AB', but can be tuples of battery
+  # indexes instead (parse_solution() reads those as "0-1"), which is the
+  # only way to name them past 26 batteries
+  def __init__(self, name, test_order, batteries=8, good=4, record=False):
 
     self.name = name
-    self.batteries = {c: Battery(c) for c in ascii_uppercase[:batteries]}
+    self.batteries = {
+      c: Battery(c, bit=1 << i)
+      for (i, c) in enumerate(battery_names(batteries))
+    }
     self.good = good
     self.test_order = []
-    for pair in test_order:
-      self.test_order.append(
-        Pair(self.batteries[pair[0]], self.batteries[pair[1]])
-      )
+    by_index = list(self.batteries.values())
+    for test in test_order:
+      self.test_order.append(Test(tuple(
+        by_index[battery_index(b)] for b in test
+      )))
+
+    # only the histogram is always kept so memory stays flat as n grows;
+    # the per-trial results are only recorded when asked for
+    self.record = record
+    self.histogram = Counter()
+    self.failures = 0
+    self.failed = []
     self.results = {}
 
+    # only set by estimate()
+    self.samples = 0
+    self.intervals = {}
+
   def analyze(self):
 
-    if not self.results:
+    if not self.histogram and not self.failures:
+      for (masks, tests) in self.first_lit():
+        if np is None:
+          self.histogram.update(tests)
+        else:
+          for (count, trials) in enumerate(np.bincount(tests).tolist()):
+            if trials:
+              self.histogram[count] += trials
 
-      last = None
-      for good in combinations(self.batteries.values(), self.good):
-        trial_name = ''.join(batt.name for batt in good)
+        shown = FAILED_SHOWN - len(self.failed)
+        if shown > 0 and 0 in self.histogram:
+          if np is None:
+            unlit = list(islice(
+              (mask for (mask, count) in zip(masks, tests) if not count), shown
+            ))
+          else:
+            unlit = masks[np.flatnonzero(tests == 0)[:shown]].tolist()
+          self.failed.extend(map(self.trial_name, unlit))
 
-        if last:
-          for batt in last:
-            batt.good = False
-        for batt in good:
-          batt.good = True
+        # per-trial results cost a python int per subset, so only if asked
+        if self.record:
+          if np is not None:
+            (masks, tests) = (masks.tolist(), tests.tolist())
+          for (mask, count) in zip(masks, tests):
+            self.results[self.trial_name(mask)] = count or inf
 
-        for (i, pair) in enumerate(self.test_order):
-          if pair:
-            self.results[trial_name] = i + 1
-            break
-        else:
-          self.results[trial_name] = inf
+        self.failures += self.histogram.pop(0, 0)
+
+    return self.histogram
+
+  def summary(self):
+    """Everything explain() needs without --verbose, as plain json data."""
+
+    self.analyze()
+    return {
+      'histogram': sorted(self.histogram.items()),
+      'failures': self.failures,
+      'failed': sorted(self.failed),
+    }
+
+  def load_summary(self, summary):
+
+    self.histogram = Counter(dict(summary['histogram']))
+    self.failures = summary['failures']
+    self.failed = summary['failed']
+    return self
+
+  def trial_name(self, mask):
 
-        last = good
+    return ''.join(
+      name for (i, name) in enumerate(self.batteries) if mask >> i & 1
+    )
+
+  def stats(self):
+    """Compute each of COLUMNS from the histogram (failures count as inf)."""
+
+    if not self.histogram and not self.failures:
+      self.analyze()
+
+    total = sum(self.histogram.values()) + self.failures
+    counts = sorted(self.histogram.items())
+    if self.failures:
+      counts.append((inf, self.failures))
+
+    if self.failures:
+      (worst, avg, sd) = (inf, inf, inf)
+    else:
+      worst = counts[-1][0]
+      sum_ = sum(tests * trials for (tests, trials) in counts)
+      sum_sq = sum(tests * tests * trials for (tests, trials) in counts)
+      avg = sum_ / total
+      if total > 1:
+        sd = sqrt((total * sum_sq - sum_ * sum_) / (total * (total - 1)))
+      else:
+        sd = nan
+
+    # the median averages the middle two values when there's an even count
+    (low, high) = ((total - 1) // 2, total // 2)
+    (med_low, med_high) = (None, None)
+    seen = 0
+    for (tests, trials) in counts:
+      seen += trials
+      if med_low is None and seen > low:
+        med_low = tests
+      if seen > high:
+        med_high = tests
+        break
+    med = med_low if low == high else (med_low + med_high) / 2
+
+    # ties go to the fewest tests
+    top = max(trials for (tests, trials) in counts)
+    mode_ = min(tests for (tests, trials) in counts if trials == top)
+
+    return dict(zip(self.COLUMNS, (worst, avg, sd, med, mode_)))
+
+  def first_lit(self, chunk=CHUNK):
+    """
+    Yield (good-set masks, tests) in batches, where tests[i] is the 1-based
+    index of the first test that lights with good-set masks[i], or 0 if none.
+    A good-set is an int with one bit per good battery, and a test lights
+    when its mask is entirely inside the good-set's mask, however many
+    batteries it takes. Batches are numpy arrays when numpy is installed,
+    otherwise lists.
+    """
+
+    pairs = [test.mask for test in self.test_order]
+    for masks in subset_masks(len(self.batteries), self.good, chunk):
+      if np is None:
+        yield (masks, _first_lit_py(masks, pairs))
+      else:
+        yield (masks, _first_lit_np(masks, pairs))
+
+  def estimate(
+    self,
+    tolerance=0.01,
+    confidence=0.95,
+    max_samples=10 ** 7,
+    jobs=None,
+    seed=None,
+    batch=SAMPLE_BATCH,
+  ):
+    """
+    Fill in the histogram from random good-sets instead of all of them, for
+    instances too big to enumerate. Each worker process samples a batch per
+    round from its own random stream, derived from (seed, worker, round) so
+    runs are reproducible with a seed. We stop once the mean (tests) and the
+    failure rate (fraction) are both within +/- tolerance at the given
+    confidence, or after max_samples. The Worst column is then only the
+    worst seen, and the intervals are in self.intervals.
+    """
+
+    pairs = [
+      tuple(batt.bit.bit_length() - 1 for batt in test.batts)
+      for test in self.test_order
+    ]
+    entropy = random.Random(seed).getrandbits(64)
+    jobs = jobs or os.cpu_count()
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    pool = ProcessPoolExecutor(jobs) if jobs > 1 else None
+    try:
+      for round_ in range(-(-max_samples // (batch * jobs))):
+        args = [
+          (
+            len(self.batteries), self.good, pairs, batch,
+            entropy, worker, round_,
+          )
+          for worker in range(jobs)
+        ]
+        for (counts, failed) in (pool.map if pool else map)(_sample, args):
+          self.failures += counts[0]
+          for (tests, trials) in enumerate(counts[1:], 1):
+            if trials:
+              self.histogram[tests] += trials
+          for subset in failed:
+            name = ''.join(
+              name for (i, name) in enumerate(self.batteries) if i in subset
+            )
+            if len(self.failed) < FAILED_SHOWN and name not in self.failed:
+              self.failed.append(name)
+        self.samples += batch * jobs
+
+        self.intervals = self.confidence_intervals(z)
+        if (
+          self.intervals['Mean'] <= tolerance
+          and self.intervals['Failed'] <= tolerance
+        ):
+          break
+    finally:
+      if pool:
+        pool.shutdown()
+
+    return self.histogram
 
-    return self.results
+  def confidence_intervals(self, z):
+    """Normal-approximation half-widths, and median bounds by rank."""
+
+    lit = sum(self.histogram.values())
+    total = lit + self.failures
+    (sum_, sum_sq) = (0, 0)
+    for (tests, trials) in self.histogram.items():
+      sum_ += tests * trials
+      sum_sq += tests * tests * trials
+
+    if lit > 1:
+      sd = sqrt((lit * sum_sq - sum_ * sum_) / (lit * (lit - 1)))
+      (mean_half, sd_half) = (z * sd / sqrt(lit), z * sd / sqrt(2 * (lit - 1)))
+    else:
+      (mean_half, sd_half) = (inf, inf)
+
+    fail_rate = self.failures / total
+    fail_half = z * sqrt(fail_rate * (1 - fail_rate) / total)
+
+    # the median's rank is roughly normal around total / 2
+    ranks = (
+      max(0, int(total / 2 - z * sqrt(total) / 2)),
+      min(total - 1, int(total / 2 + z * sqrt(total) / 2)),
+    )
+    counts = sorted(self.histogram.items()) + [(inf, self.failures)]
+    bounds = []
+    for rank in ranks:
+      seen = 0
+      for (tests, trials) in counts:
+        seen += trials
+        if seen > rank:
+          bounds.append(tests)
+          break
+
+    return {
+      'Mean': mean_half,
+      'Stdev': sd_half,
+      'Median': tuple(bounds),
+      'Failed': fail_half,
+      'FailRate': fail_rate,
+    }
 
   def explain(
     self,
@@ -180,60 +543,1046 @@ class Solution:
     verbose=False,
   ):
 
-    if not self.results:
-      self.analyze()
+    stats = self.stats()
 
     if header:
       print(f'===== {self.name} =====')
     if measure_names:
       print(self.HEADER + ' = ', end='')
 
-    vals = self.results.values()
-    try:
-      sd = stdev(vals)
-    except OverflowError:
-      sd = inf
-
     print(
-        f'{max(vals):5.0f} | {mean(vals):5.2f} | {sd:5.2f}'
-      f' | {median(vals):6.1f} | {mode(vals):4.0f}'
+        f'{stats["Worst"]:5.0f} | {stats["Mean"]:5.2f} | {stats["Stdev"]:5.2f}'
+      f' | {stats["Median"]:6.1f} | {stats["Mode"]:4.0f}'
     )
 
-    if failed:
-      failed = []
-      for (name, tests) in self.results.items():
-        if tests is inf:
-          failed.append(name)
-      if failed:
-        print(f'    FAILED {len(failed)}: ' + ', '.join(sorted(failed)))
+    if self.samples:
+      ci = self.intervals
+      print(
+        f'    ESTIMATED from {self.samples} samples:'
+        f' Mean +/-{ci["Mean"]:.3f}, Stdev +/-{ci["Stdev"]:.3f},'
+        f' Median {ci["Median"][0]}-{ci["Median"][1]},'
+        f' Failed {ci["FailRate"]:.2%} +/-{ci["Failed"]:.2%}'
+      )
+
+    if failed and self.failures:
+      names = ', '.join(sorted(self.failed))
+      if self.failures > len(self.failed):
+        names += ', ...'
+      print(f'    FAILED {self.failures}: ' + names)
 
     if detail:
-      counts = Counter()
-      for count in self.results.values():
-        counts[count] += 1
+      counts = sorted(self.histogram.items())
+      if self.failures:
+        counts.append((inf, self.failures))
       print(
         '    FREQ: {}'.format(
-          ', '.join(
-            f'{tests}={count}' for (tests, count) in sorted(counts.items())
-          )
+          ', '.join(f'{tests}={count}' for (tests, count) in counts)
         )
       )
 
-    if verbose:
+    if verbose and self.results:
       print('    ALL RESULTS:')
       for (name, tests) in sorted(self.results.items()):
         print(f'        {name}={tests}')
 
 
-def parse_solution(s):
+class ResultCache:
+  """Solution summaries on disk, keyed by a hash of what they depend on."""
+
+  def __init__(self, path=DEFAULT_CACHE):
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    self.db = sqlite3.connect(path)
+    self.db.execute(
+      'CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, value TEXT)'
+    )
+
+  @staticmethod
+  def open(path):
+    """Return a ResultCache at path, or None with a warning if it can't be."""
+
+    try:
+      return ResultCache(path)
+    except (OSError, sqlite3.Error) as e:
+      print(f'warning: not caching results in {path}: {e}', file=sys.stderr)
+      return None
+
+  @staticmethod
+  def key(test_order, batteries, good):
+
+    return sha256(
+      json.dumps([CACHE_VERSION, list(test_order), batteries, good]).encode()
+    ).hexdigest()
+
+  def get(self, key):
+
+    row = self.db.execute(
+      'SELECT value FROM summaries WHERE key = ?', (key,)
+    ).fetchone()
+    return row and json.loads(row[0])
+
+  def put(self, items):
+
+    with self.db:
+      self.db.executemany(
+        'INSERT OR REPLACE INTO summaries VALUES (?, ?)',
+        ((key, json.dumps(summary)) for (key, summary) in items),
+      )
+
+
+def analyze_all(
+  solutions,
+  batteries=8,
+  good=4,
+  jobs=None,
+  cache=None,
+  pool=None,
+):
+  """
+  Analyze {name: test_order} across a process pool and return {name:
+  Solution}. Summaries found in the cache are reused, and new ones are added.
+  Pass an executor as pool to reuse it across calls instead of starting one.
+  Orders are analyzed and cached by canonical() form, so relabeled, reversed
+  or repeated pairs of an order already seen don't need analyzing again.
+  """
+
+  analyzed = {}
+  forms = {}
+  todo = {}
+  for (name, test_order) in solutions.items():
+    analyzed[name] = Solution(name, test_order, batteries, good)
+    forms[name] = canonical(test_order, batteries)
+    key = ResultCache.key(forms[name][0], batteries, good)
+    if cache and (summary := cache.get(key)):
+      analyzed[name].load_summary(relabel_summary(summary, *forms[name][1:]))
+    else:
+      todo.setdefault(key, []).append(name)
+
+  args = [(forms[names[0]][0], batteries, good) for names in todo.values()]
+  if pool:
+    summaries = list(pool.map(_summarize, args))
+  elif jobs == 1 or len(args) < 2:
+    summaries = list(map(_summarize, args))
+  else:
+    with ProcessPoolExecutor(jobs) as pool:
+      summaries = list(pool.map(_summarize, args))
+
+  done = []
+  for ((key, names), summary) in zip(todo.items(), summaries):
+    for name in names:
+      analyzed[name].load_summary(relabel_summary(summary, *forms[name][1:]))
+    done.append((key, summary))
+  if cache and done:
+    cache.put(done)
+
+  return analyzed
+
+
+def _summarize(args):
+
+  return Solution(None, *args).summary()
+
+
+def analyze_trie(solutions, batteries=8, good=4, cache=None):
+  """Same as analyze_all() but in-process, sharing work between prefixes."""
+
+  analyzed = {}
+  trie = TrieEvaluator(batteries, good)
+  forms = {}
+  todo = {}
+  for (name, test_order) in solutions.items():
+    analyzed[name] = Solution(name, test_order, batteries, good)
+    forms[name] = canonical(test_order, batteries)
+    key = ResultCache.key(forms[name][0], batteries, good)
+    if cache and (summary := cache.get(key)):
+      analyzed[name].load_summary(relabel_summary(summary, *forms[name][1:]))
+    else:
+      if key not in todo:
+        trie.add(key, forms[name][0])
+      todo.setdefault(key, []).append(name)
+
+  done = []
+  for (key, summary) in trie.evaluate():
+    for name in todo[key]:
+      analyzed[name].load_summary(relabel_summary(summary, *forms[name][1:]))
+    done.append((key, summary))
+  if cache and done:
+    cache.put(done)
+
+  return analyzed
+
+
+class TrieEvaluator:
+  """
+  Evaluate many test orders at once by sharing their common prefixes, e.g.
+  every mutation of a base order that starts AB,CD,EF only tests those once.
+
+  Orders are inserted into a trie of pairs. Walking it pushes the still-unlit
+  good-sets down as a bitset over subset indexes, so each node costs one AND
+  with its pair's precomputed cover bitset, and an order's histogram is just
+  how many good-sets each node along its path lit.
+  """
+
+  def __init__(self, batteries=8, good=4):
+
+    self.batteries = batteries
+    self.good = good
+    self.subsets = [
+      sum(1 << b for b in combo)
+      for combo in combinations(range(batteries), good)
+    ]
+    self.names = battery_names(batteries)
+    self.covers = {}
+    self.root = {}
+
+  def add(self, name, test_order):
+
+    node = self.root
+    for pair in test_order:
+      node = node.setdefault(self.mask(pair), {})
+    node.setdefault(None, []).append(name)
+
+  def mask(self, pair):
+
+    mask = 0
+    for batt in pair:
+      mask |= 1 << battery_index(batt)
+    if mask not in self.covers:
+      self.covers[mask] = sum(
+        1 << i for (i, s) in enumerate(self.subsets) if s & mask == mask
+      )
+    return mask
+
+  def evaluate(self):
+    """Yield (name, summary) for every order added, like Solution.summary()."""
+
+    # lit[d] is how many good-sets test d + 1 on the current path lit
+    lit = []
+    stack = [(self.root, (1 << len(self.subsets)) - 1, 0, 0)]
+    while stack:
+      (node, unlit, depth, count) = stack.pop()
+      if depth:
+        del lit[depth - 1:]
+        lit.append(count)
+
+      if names := node.get(None):
+        summary = {
+          'histogram': [
+            (tests, count) for (tests, count) in enumerate(lit, 1) if count
+          ],
+          'failures': unlit.bit_count(),
+          'failed': self.failed(unlit),
+        }
+        for name in names:
+          yield (name, summary)
+
+      for (mask, child) in node.items():
+        if mask is not None:
+          cover = self.covers[mask]
+          stack.append(
+            (child, unlit & ~cover, depth + 1, (unlit & cover).bit_count())
+          )
+
+  def failed(self, unlit):
+
+    names = []
+    while unlit and len(names) < FAILED_SHOWN:
+      i = (unlit & -unlit).bit_length() - 1
+      unlit &= unlit - 1
+      names.append(''.join(
+        name for (b, name) in enumerate(self.names)
+        if self.subsets[i] >> b & 1
+      ))
+    return names
+
+
+def bulk(
+  infile,
+  outfile,
+  fmt='jsonl',
+  batteries=8,
+  good=4,
+  jobs=None,
+  cache=None,
+  trie=False,
+  size=2,
+):
+  """
+  Analyze one test order per line of infile, optionally prefixed "name:",
+  and write a jsonl or csv row per order as each batch finishes, so memory
+  stays flat however many orders there are. Lines that don't parse get a row
+  with just an error. Failures count as inf, which is null in jsonl. With
+  trie, each batch is analyzed in-process by analyze_trie() instead, which
+  wins when most orders share long prefixes.
+  """
+
+  columns = (
+    ['name', 'order']
+    + [col.lower() for col in Solution.COLUMNS]
+    + ['failures', 'histogram', 'error']
+  )
+  if fmt == 'csv':
+    writer = csv.DictWriter(outfile, columns)
+    writer.writeheader()
+
+  def write(rows):
+    for row in rows:
+      if fmt == 'csv':
+        row['histogram'] = ' '.join(
+          f'{tests}={count}' for (tests, count) in row['histogram'].items()
+        )
+        writer.writerow(row)
+      else:
+        row = {col: None if val == inf else val for (col, val) in row.items()}
+        outfile.write(json.dumps(row) + '\n')
+    outfile.flush()
+
+  def analyze(batch):
+    # names may repeat, so key by position in the batch
+    solutions = {
+      i: order for (i, (name, order, error)) in enumerate(batch) if not error
+    }
+    if trie:
+      analyzed = analyze_trie(solutions, batteries, good, cache)
+    else:
+      analyzed = analyze_all(solutions, batteries, good, jobs, cache, pool)
+    rows = []
+    for (i, (name, order, error)) in enumerate(batch):
+      row = dict.fromkeys(columns)
+      row.update(name=name, histogram={})
+      if error:
+        row.update(order=order, error=error)
+      else:
+        row['order'] = ','.join(map(test_name, order))
+        solution = analyzed[i]
+        for (col, val) in solution.stats().items():
+          row[col.lower()] = val
+        row['failures'] = solution.failures
+        row['histogram'] = {
+          str(tests): count
+          for (tests, count) in sorted(solution.histogram.items())
+        }
+      rows.append(row)
+    write(rows)
+
+  pool = ProcessPoolExecutor(jobs) if jobs != 1 and not trie else None
+  try:
+    batch = []
+    for (i, line) in enumerate(infile, 1):
+      if not (line := line.strip()) or line.startswith('#'):
+        continue
+      (name, _, text) = line.rpartition(':')
+      (name, error) = (name.strip() or f'line {i}', None)
+      try:
+        order = parse_solution(text)
+        if not fits(order, batteries, size):
+          raise ValueError(
+            f'uses more than {batteries} batteries or not {size} per test'
+          )
+      except ValueError as e:
+        (order, error) = (text.strip(), str(e))
+      batch.append((name, order, error))
+      if len(batch) == BULK_BATCH:
+        analyze(batch)
+        batch = []
+    if batch:
+      analyze(batch)
+  finally:
+    if pool:
+      pool.shutdown()
+
+
+class WorstCaseSearch:
+  """
+  Find a test order with the fewest tests that always lights, and prove no
+  shorter one exists. Order doesn't matter for the worst case, so this is
+  iterative deepening over covers: pairs such that every good-set contains
+  one of them.
+  """
+
+  def __init__(self, batteries=8, good=4, size=2):
+
+    self.batteries = batteries
+    self.good = good
+    self.size = size
+    self.nodes = 0
+
+    (self.pairs, self.subsets, self.covers) = cover_tables(
+      batteries, good, size
+    )
+    self.inside = [
+      [
+        p for (p, pair) in enumerate(self.pairs)
+        if all(s >> b & 1 for b in pair)
+      ]
+      for s in self.subsets
+    ]
+    # conflicts[i] is every good-set sharing a pair with good-set i
+    self.conflicts = []
+    for inside in self.inside:
+      conflict = 0
+      for p in inside:
+        conflict |= self.covers[p]
+      self.conflicts.append(conflict)
+    self.relabel = Relabeler(batteries, self.subsets)
+    self.all = (1 << len(self.subsets)) - 1
+    self.failed = {}
+
+  def run(self, max_tests=None):
+    """Return the optimal order as ['AB', ...], or None if there is none."""
+
+    if (depth := self.lower_bound(self.all)) is None:
+      return None
+
+    while max_tests is None or depth <= max_tests:
+      found = self.search(self.all, [], (0,) * self.batteries, depth)
+      if found is not None:
+        return [pair_name(self.pairs[p]) for p in found]
+      depth += 1
+
+    return None
+
+  def lower_bound(self, uncovered):
+
+    gain = max((cover & uncovered).bit_count() for cover in self.covers)
+    if not gain:
+      return None
+
+    # good-sets sharing no pair each need a pair of their own
+    (packed, left) = (0, uncovered)
+    while left:
+      packed += 1
+      left &= ~self.conflicts[(left & -left).bit_length() - 1]
+
+    return max(-(-uncovered.bit_count() // gain), packed)
+
+  # tested[b] is the bitset of batteries that battery b was tested with
+  def search(self, uncovered, chosen, tested, depth):
+
+    self.nodes += 1
+    if not uncovered:
+      return list(chosen)
+    if not depth:
+      return None
+    # the bound is cheaper than the key, so there's no need to record it
+    if (bound := self.lower_bound(uncovered)) is None or bound > depth:
+      return None
+    if self.failed.get(key := self.relabel(uncovered), -1) >= depth:
+      return None
+
+    # twins share a tested-with set (apart from each other, for true twins)
+    twins = Counter(tested)
+    label = [
+      tested[b]
+      if twins[tested[b]] > 1 and (self.size == 2 or not tested[b])
+      else ~(tested[b] | 1 << b)
+      for b in range(self.batteries)
+    ]
+
+    # every cover has a pair inside the first uncovered good-set
+    first = (uncovered & -uncovered).bit_length() - 1
+    tried = set()
+    for p in sorted(
+      self.inside[first],
+      key=lambda p: -(self.covers[p] & uncovered).bit_count(),
+    ):
+      pair = self.pairs[p]
+      if (twin := tuple(sorted(label[b] for b in pair))) in tried:
+        continue
+      tried.add(twin)
+
+      tested_next = list(tested)
+      for b in pair:
+        for other in pair:
+          if other != b:
+            tested_next[b] |= 1 << other
+      chosen.append(p)
+      found = self.search(
+        uncovered & ~self.covers[p],
+        chosen,
+        tuple(tested_next),
+        depth - 1,
+      )
+      chosen.pop()
+      if found is not None:
+        return found
+
+    self.failed[key] = depth
+    return None
+
+
+class AdaptiveSearch:
+  """
+  Optimize strategies that choose each test based on what happened so far.
+  The only thing a tester ever learns is that a pair didn't light (lighting
+  ends the game), so a knowledge state is just the set of good-sets still
+  consistent with the failures, and every adaptive strategy is a fixed order
+  that never spends an insertion on a pair already known not to light.
+
+  value() solves the game exactly over knowledge states, memoized in a
+  transposition table. States are relabeled by sorting batteries on how
+  many consistent good-sets they're in, so most states that only differ by
+  a battery permutation share a table entry.
+  """
+
+  OBJECTIVES = ('worst', 'mean')
+
+  def __init__(self, batteries=8, good=4, objective='mean', size=2):
+
+    if objective not in self.OBJECTIVES:
+      raise ValueError(f'objective must be one of {self.OBJECTIVES}')
+
+    self.batteries = batteries
+    self.good = good
+    self.objective = objective
 
+    (self.pairs, self.subsets, self.covers) = cover_tables(
+      batteries, good, size
+    )
+    self.relabel = Relabeler(batteries, self.subsets)
+    self.all = (1 << len(self.subsets)) - 1
+    self.table = {}
+
+  def evaluate(self, test_order):
+    """Return (worst, mean) insertions for test_order, skipping dead tests."""
+
+    covers = dict(zip(self.pairs, self.covers))
+    (consistent, tests, total) = (self.all, 0, 0)
+    for pair in test_order:
+      pair = tuple(sorted(map(battery_index, pair)))
+      if consistent & (cover := covers[pair]):
+        total += consistent.bit_count()
+        tests += 1
+        consistent &= ~cover
+        if not consistent:
+          return (tests, total / len(self.subsets))
+
+    return (inf, inf)
+
+  def run(self):
+    """Return (worst, mean, order) for the optimal strategy, or None."""
+
+    if self.value(self.all) is None:
+      return None
+
+    (order, consistent) = ([], self.all)
+    while consistent:
+      (best, best_p) = (None, None)
+      for (p, cover) in enumerate(self.covers):
+        if consistent & cover:
+          value = self.rank(self.value(consistent & ~cover))
+          if best is None or value < best:
+            (best, best_p) = (value, p)
+      order.append(pair_name(self.pairs[best_p]))
+      consistent &= ~self.covers[best_p]
+
+    (worst, total) = self.value(self.all)
+    return (worst, total / len(self.subsets), order)
+
+  def value(self, consistent):
+    """
+    Return (worst, total) insertions from this state, total being summed over
+    the consistent good-sets, or None if some of them can never light.
+    """
+
+    if not consistent:
+      return (0, 0)
+    if (key := self.relabel(consistent)) in self.table:
+      return self.table[key]
+
+    size = consistent.bit_count()
+    (best, seen) = (None, set())
+    for cover in self.covers:
+      if not consistent & cover or (child := consistent & ~cover) in seen:
+        continue
+      seen.add(child)
+      if (value := self.value(child)) is None:
+        continue
+      value = (value[0] + 1, value[1] + size)
+      if best is None or self.rank(value) < self.rank(best):
+        best = value
+
+    self.table[key] = best
+    return best
+
+  def rank(self, value):
+
+    if value is None:
+      return (inf, inf)
+    return value if self.objective == 'worst' else value[::-1]
+
+
+class Annealer:
+  """
+  Simulated annealing over test orders for the best mean, where a good-set
+  that never lights costs more than any test could.
+
+  Moves swap two tests, replace one, or insert or remove one. Rather than
+  re-analyzing the whole order, we keep the unlit good-sets after every
+  prefix of the order: a move only changes tests from some position on, so
+  we re-walk from there just until the unlit set matches the old order's
+  again, after which the rest of the order lights exactly what it did before
+  (only shifted by inserts/removes).
+  """
+
+  MOVES = ('swap', 'replace', 'insert', 'remove')
+
+  def __init__(self, batteries=8, good=4, seed=None, size=2):
+
+    self.batteries = batteries
+    self.good = good
+    (self.pairs, self.subsets, self.covers) = cover_tables(
+      batteries, good, size
+    )
+    self.all = (1 << len(self.subsets)) - 1
+    self.penalty = len(self.pairs) + 1
+    self.random = random.Random(seed)
+    self.load(self.random.sample(range(len(self.pairs)), len(self.pairs)))
+
+  def load(self, order):
+    """Start from order, a list of indexes into self.pairs."""
+
+    self.order = list(order)
+    self.unlit = [self.all]  # unlit[t] is what's unlit after t tests
+    self.lit = []  # lit[t] is how many good-sets test t + 1 lit first
+    for p in self.order:
+      cover = self.covers[p]
+      self.lit.append((self.unlit[-1] & cover).bit_count())
+      self.unlit.append(self.unlit[-1] & ~cover)
+    self.score = (
+      sum(t * lit for (t, lit) in enumerate(self.lit, 1))
+      + self.penalty * self.unlit[-1].bit_count()
+    )
+
+  def propose(self):
+    """Return (start, stop, window), a move replacing order[start:stop]."""
+
+    (order, rand) = (self.order, self.random)
+    size = len(order)
+    move = rand.choice(self.MOVES)
+    if move == 'swap' and size > 1:
+      (i, j) = sorted(rand.sample(range(size), 2))
+      return (i, j + 1, [order[j]] + order[i + 1:j] + [order[i]])
+    if move == 'remove' and size > 1:
+      i = rand.randrange(size)
+      return (i, i + 1, [])
+    # orders never outgrow the pairs, so self.penalty outweighs any position
+    if move == 'insert' and size < len(self.pairs):
+      i = rand.randrange(size + 1)
+      return (i, i, [rand.randrange(len(self.pairs))])
+    i = rand.randrange(size)
+    return (i, i + 1, [rand.randrange(len(self.pairs))])
+
+  def delta(self, start, stop, window):
+    """
+    Return (score, old, unlit, lit) after a move: old is where the re-walk
+    caught up in the old order, and unlit and lit replace
+    self.unlit[start + 1:old + 1] and self.lit[start:old].
+    """
+
+    (order, unlit) = (self.order, self.unlit)
+    (new_unlit, new_lit, gained) = ([], [], 0)
+    current = unlit[start]
+
+    def walk(p, t):
+      nonlocal current, gained
+      cover = self.covers[p]
+      new_lit.append(lit := (current & cover).bit_count())
+      current &= ~cover
+      new_unlit.append(current)
+      gained += t * lit
+
+    for (t, p) in enumerate(window, start + 1):
+      walk(p, t)
+    old = stop
+    while old < len(order) and current != unlit[old]:
+      walk(order[old], old + len(window) - (stop - start) + 1)
+      old += 1
+
+    lost = sum(
+      t * lit for (t, lit) in enumerate(self.lit[start:old], start + 1)
+    )
+    if current == unlit[old]:
+      tail = unlit[old].bit_count() - unlit[-1].bit_count()
+      shift = len(window) - (stop - start)
+      score = self.score - lost + gained + shift * tail
+    else:
+      unlit_change = current.bit_count() - unlit[-1].bit_count()
+      score = self.score - lost + gained + self.penalty * unlit_change
+
+    return (score, old, new_unlit, new_lit)
+
+  def run(self, steps=100000, start_temp=None, end_temp=None):
+    """Return (total tests over all good-sets, order) for the best found."""
+
+    start_temp = start_temp or len(self.subsets) / 10
+    end_temp = end_temp or len(self.subsets) / 1000
+    cool = (end_temp / start_temp) ** (1 / max(steps, 1))
+    temp = start_temp
+
+    (best, best_order) = (self.score, list(self.order))
+    for _ in range(steps):
+      (start, stop, window) = self.propose()
+      (score, old, new_unlit, new_lit) = self.delta(start, stop, window)
+      diff = score - self.score
+      if diff <= 0 or self.random.random() < exp(-diff / temp):
+        self.order[start:stop] = window
+        self.unlit[start + 1:old + 1] = new_unlit
+        self.lit[start:old] = new_lit
+        self.score = score
+        if score < best:
+          (best, best_order) = (score, list(self.order))
+      temp *= cool
+
+    # drop tests that can't light anything by the time they're reached
+    (order, unlit) = ([], self.all)
+    for p in best_order:
+      if unlit & self.covers[p]:
+        order.append(pair_name(self.pairs[p]))
+        unlit &= ~self.covers[p]
+
+    return (None if unlit else best, order)
+
+
+def anneal_all(
+  batteries=8,
+  good=4,
+  steps=100000,
+  restarts=4,
+  jobs=None,
+  seed=None,
+  size=2,
+):
+  """Run independent Annealers in a process pool and keep the best."""
+
+  seeds = [None if seed is None else seed + i for i in range(restarts)]
+  args = [(batteries, good, steps, s, size) for s in seeds]
+  if jobs == 1 or restarts < 2:
+    results = list(map(_anneal, args))
+  else:
+    with ProcessPoolExecutor(jobs) as pool:
+      results = list(pool.map(_anneal, args))
+
+  return min(results, key=lambda result: (result[0] is None, result[0] or 0))
+
+
+def _anneal(args):
+
+  (batteries, good, steps, seed, size) = args
+  return Annealer(batteries, good, seed, size).run(steps)
+
+
+class Relabeler:
+  """
+  Relabel a bitset of good-sets (bit i for subsets[i]) by sorting batteries
+  on how many of those good-sets they're in. Equal results always mean the
+  same good-sets up to a battery permutation, and most permutations of one
+  set of good-sets give the same result, so it makes a cheap table key.
+  """
+
+  def __init__(self, batteries, subsets):
+
+    self.batteries = batteries
+    self.index = {s: i for (i, s) in enumerate(subsets)}
+    self.members = [
+      sum(1 << i for (i, s) in enumerate(subsets) if s >> b & 1)
+      for b in range(batteries)
+    ]
+    self.batts = [
+      tuple(b for b in range(batteries) if s >> b & 1) for s in subsets
+    ]
+
+  def __call__(self, sets):
+
+    order = sorted(
+      range(self.batteries),
+      key=lambda b: (sets & self.members[b]).bit_count(),
+    )
+    bits = [0] * self.batteries
+    for (new, old) in enumerate(order):
+      bits[old] = 1 << new
+
+    (index, batts) = (self.index, self.batts)
+    relabeled = 0
+    while sets:
+      low = sets & -sets
+      sets ^= low
+      mask = 0
+      for b in batts[low.bit_length() - 1]:
+        mask |= bits[b]
+      relabeled |= 1 << index[mask]
+
+    return relabeled
+
+
+def cover_tables(batteries, good, size=2):
+  """
+  Return (pairs, subsets, covers) where pairs are tuples of size battery
+  indexes (every possible test), subsets are good-set masks, and covers[p]
+  has bit i set if pairs[p] lights with good-set subsets[i].
+  """
+
+  pairs = list(combinations(range(batteries), size))
+  subsets = [
+    sum(1 << b for b in combo)
+    for combo in combinations(range(batteries), good)
+  ]
+  covers = []
+  for test in pairs:
+    pair = sum(1 << b for b in test)
+    covers.append(
+      sum(1 << i for (i, s) in enumerate(subsets) if s & pair == pair)
+    )
+
+  return (pairs, subsets, covers)
+
+
+def canonical(test_order, batteries=8):
+  """
+  Return (form, labels, tests) where form is test_order in a normal form
+  shared by every order that only differs by relabeling batteries, writing
+  pairs reversed, or repeating pairs, so equal forms always analyze the same.
+  labels[i] is the original name of canonical battery i, and tests[t] is
+  the 1-based position in test_order of form[t].
+  """
+
+  names = battery_names(batteries)
   pairs = []
-  for pair in s.split(','):
-    if len(pair := pair.strip()) != 2:
-      raise ValueError(f'pair "{pair}" is not 2 characters')
-    pairs.append(pair)
+  tests = []
+  for (t, pair) in enumerate(test_order, 1):
+    pair = tuple(sorted(battery_index(b) for b in pair))
+    if pair not in pairs:
+      pairs.append(pair)
+      tests.append(t)
+
+  # batteries no test has told apart yet share a block of labels, and each
+  # test takes the lowest labels of every block it touches
+  blocks = []
+  seen = set()
+  form = []
+  for pair in pairs:
+    refined = []
+    for block in blocks:
+      refined.append([b for b in block if b in pair])
+      refined.append([b for b in block if b not in pair])
+    refined.append([b for b in pair if b not in seen])
+    blocks = [block for block in refined if block]
+    seen.update(pair)
+
+    (label, labels) = (0, [])
+    for block in blocks:
+      if block[0] in pair:
+        labels.extend(range(label, label + len(block)))
+      label += len(block)
+    form.append(tuple(labels))
+
+  order = [b for block in blocks for b in block]
+  order += [b for b in range(batteries) if b not in seen]
+  labels = [names[b] for b in order]
+
+  return (tuple(form), labels, tuple(tests))
+
+
+def relabel_summary(summary, labels, tests):
+  """Map a summary of a canonical() form back onto the order it came from."""
+
+  rename = dict(zip(battery_names(len(labels)), labels))
+  return {
+    'histogram': [
+      (tests[count - 1], trials) for (count, trials) in summary['histogram']
+    ],
+    'failures': summary['failures'],
+    'failed': sorted(
+      ''.join(sorted(
+        (rename[batt] for batt in split_names(name)), key=battery_index
+      ))
+      for name in summary['failed']
+    ),
+  }
+
+
+def pair_name(pair):
+
+  if max(pair) < len(ascii_uppercase):
+    return ''.join(ascii_uppercase[b] for b in pair)
+  return '-'.join(map(str, pair))
+
+
+def test_name(test):
+  """Write a test from parse_solution() back the way it was given."""
+
+  return test if isinstance(test, str) else '-'.join(map(str, test))
+
+
+def subset_masks(n, k, chunk=CHUNK):
+  """Yield every k-subset of n bits as int masks, in batches of <= chunk."""
 
-  return pairs
+  if np is None:
+    subsets = combinations([1 << i for i in range(n)], k)
+    while batch := [sum(bits) for bits in islice(subsets, chunk)]:
+      yield batch
+    return
+
+  # split the bits into a low and a high half so each batch is a single
+  # broadcast OR of small precomputed tables instead of a python loop
+  low = n // 2
+  for high_k in range(max(0, k - low), min(k, n - low) + 1):
+    lows = _combination_masks(low, k - high_k)
+    highs = _combination_masks(n - low, high_k) << low
+    rows = max(1, chunk // len(lows))
+    for i in range(0, len(highs), rows):
+      yield (highs[i:i + rows, None] | lows[None, :]).ravel()
+
+
+def _combination_masks(n, k):
+
+  masks = np.zeros(1, dtype=np.int64)
+  lowest = np.zeros(1, dtype=np.int64)  # lowest bit each mask may still add
+  for _ in range(k):
+    (new_masks, new_lowest) = ([], [])
+    for bit in range(n):
+      can_add = lowest <= bit
+      new_masks.append(masks[can_add] | (1 << bit))
+      new_lowest.append(np.full(can_add.sum(), bit + 1, dtype=np.int64))
+    masks = np.concatenate(new_masks)
+    lowest = np.concatenate(new_lowest)
+
+  return masks
+
+
+def _first_lit_py(masks, pairs):
+
+  results = []
+  for mask in masks:
+    for (i, pair) in enumerate(pairs, 1):
+      if mask & pair == pair:
+        results.append(i)
+        break
+    else:
+      results.append(0)
+
+  return results
+
+
+def _first_lit_np(masks, pairs):
+
+  results = np.zeros(len(masks), dtype=np.int32)
+  pending = np.arange(len(masks))
+  for (i, pair) in enumerate(pairs, 1):
+    if not len(pending):
+      break
+    lit = masks & pair == pair
+    results[pending[lit]] = i
+    pending = pending[~lit]
+    masks = masks[~lit]
+
+  return results
+
+
+def fits(test_order, batteries, size=2):
+
+  return all(
+    len(test) == size and all(battery_index(b) < batteries for b in test)
+    for test in test_order
+  )
+
+
+def battery_index(batt):
+  """Return the index of a battery given as an index, a letter or '#i'."""
+
+  if isinstance(batt, int):
+    return batt
+  if batt.startswith('#'):
+    return int(batt[1:])
+  return ascii_uppercase.index(batt)
+
+
+def split_names(name):
+  """Split a good-set name from Solution.trial_name() into battery names."""
+
+  if name.startswith('#'):
+    return ['#' + i for i in name[1:].split('#')]
+  return list(name)
+
+
+def battery_names(batteries):
+
+  if batteries <= len(ascii_uppercase):
+    return list(ascii_uppercase[:batteries])
+  return [f'#{i}' for i in range(batteries)]
+
+
+def _sample(args):
+  """
+  Return (counts, failed) for one batch of random good-sets, where counts[t]
+  is how many first lit on test t (0 for never), and failed holds up to
+  FAILED_SHOWN of the good-sets that never lit, as sets of battery indexes.
+  """
+
+  (batteries, good, pairs, batch, entropy, worker, round_) = args
+
+  if np is None:
+    rand = random.Random(f'{entropy}-{worker}-{round_}')
+    counts = [0] * (len(pairs) + 1)
+    failed = []
+    for _ in range(batch):
+      subset = set(rand.sample(range(batteries), good))
+      for (i, test) in enumerate(pairs, 1):
+        if subset.issuperset(test):
+          counts[i] += 1
+          break
+      else:
+        counts[0] += 1
+        if len(failed) < FAILED_SHOWN:
+          failed.append(subset)
+    return (counts, failed)
+
+  rand = np.random.default_rng(
+    np.random.SeedSequence(entropy, spawn_key=(worker, round_))
+  )
+  chosen = np.argpartition(rand.random((batch, batteries)), good - 1, axis=1)
+  is_good = np.zeros((batch, batteries), dtype=bool)
+  np.put_along_axis(is_good, chosen[:, :good], True, axis=1)
+
+  first = np.zeros(batch, dtype=np.int32)
+  pending = np.arange(batch)
+  for (i, test) in enumerate(pairs, 1):
+    if not len(pending):
+      break
+    lit = is_good[pending][:, list(test)].all(axis=1)
+    first[pending[lit]] = i
+    pending = pending[~lit]
+
+  failed = [
+    set(np.flatnonzero(is_good[row]).tolist())
+    for row in pending[:FAILED_SHOWN]
+  ]
+  return (np.bincount(first, minlength=len(pairs) + 1).tolist(), failed)
+
+
+def parse_solution(s):
+  """
+  Parse tests like "AB,AC,..." or, to name batteries past Z, tests of
+  0-based indexes like "0-1,0-2,...", which become tuples of ints.
+  """
+
+  tests = []
+  for text in s.split(','):
+    test = text = text.strip()
+    if '-' in test:
+      try:
+        test = tuple(int(b) for b in test.split('-'))
+      except ValueError:
+        raise ValueError(f'test "{text}" is not battery indexes like 0-1')
+    elif not all(b in ascii_uppercase for b in test):
+      raise ValueError(f'test "{text}" is not letters A-Z')
+    if len(test) < 2 or len(set(test)) != len(test):
+      raise ValueError(f'test "{text}" is not 2+ different batteries')
+    if tests and len(test) != len(tests[0]):
+      raise ValueError(f'test "{text}" is not {len(tests[0])} batteries')
+    tests.append(test)
+
+  return tests
 
 
 def get_args():
@@ -247,7 +1596,7 @@ def get_args():
   )
   add(
     '-s', '--solution', type=parse_solution,
-    help='analyze a solution (e.g. "AB,AC,...")',
+    help='analyze a solution (e.g. "AB,AC,...", or "0-1,0-2,..." past Z)',
   )
   add(
     '-S', '--name', default=CUSTOM_NAME,
@@ -257,13 +1606,108 @@ def get_args():
     '-v', '--verbose', action='store_true',
     help='show all individual test counts',
   )
+  add(
+    '-b', '--batteries', type=int, default=8,
+    help='total number of batteries (default: 8)',
+  )
+  add(
+    '-g', '--good', type=int, default=4,
+    help='number of batteries that work (default: 4)',
+  )
+  add(
+    '-k', '--size', type=int,
+    help='batteries the device takes (default: as in --solution, else 2)',
+  )
+  add(
+    '-o', '--optimize', action='store_true',
+    help='search for a test order with the fewest tests in the worst case',
+  )
+  add(
+    '-a', '--adaptive', nargs='?', const='mean',
+    choices=AdaptiveSearch.OBJECTIVES,
+    help='solve for the best adaptive strategy by mean (default) or worst',
+  )
+  add(
+    '-j', '--jobs', type=int,
+    help='processes to analyze solutions with (default: one per cpu)',
+  )
+  add(
+    '-c', '--cache', type=Path, default=DEFAULT_CACHE,
+    help=f'file to cache results in (default: {DEFAULT_CACHE})',
+  )
+  add(
+    '-C', '--no-cache', action='store_const', const=None, dest='cache',
+    help='neither read nor write cached results',
+  )
+  add(
+    '-f', '--file', type=FileType('r'),
+    help='analyze one solution per line of FILE ("-" for stdin) in bulk',
+  )
+  add(
+    '-F', '--format', choices=('jsonl', 'csv'), default='jsonl', dest='fmt',
+    help='row format for --file (default: jsonl)',
+  )
+  add(
+    '-O', '--output', type=FileType('w'), default=sys.stdout,
+    help='where to write --file rows (default: stdout)',
+  )
+  add(
+    '-T', '--trie', action='store_true',
+    help='share work between --file solutions with common prefixes',
+  )
+  add(
+    '-A', '--anneal', type=int, default=0, metavar='STEPS',
+    help='search for a low mean by simulated annealing for STEPS steps',
+  )
+  add(
+    '-r', '--restarts', type=int, default=4,
+    help='independent --anneal runs to keep the best of (default: 4)',
+  )
+  add(
+    '--seed', type=int,
+    help='random seed for --anneal/--estimate, for reproducible runs',
+  )
+  add(
+    '-e', '--estimate', action='store_true',
+    help='estimate by sampling good-sets instead of trying all of them',
+  )
+  add(
+    '--tolerance', type=float, default=0.01,
+    help='stop --estimate once the mean is within +/- this (default: 0.01)',
+  )
+  add(
+    '--confidence', type=float, default=0.95,
+    help='confidence level for --estimate intervals (default: 0.95)',
+  )
+  add(
+    '--max-samples', type=int, default=10 ** 7,
+    help='stop --estimate after this many samples (default: 10000000)',
+  )
+
+  profiler.add_arguments(ap)
 
   args = ap.parse_args()
   if args.verbose:
     args.detail = True
+  if args.batteries < 1:
+    ap.error('--batteries must be at least 1')
+  if args.batteries > MAX_BATTERIES and not args.estimate:
+    ap.error(f'--batteries over {MAX_BATTERIES} needs --estimate')
+  if not 0 <= args.good <= args.batteries:
+    ap.error('--good must be between 0 and --batteries')
+  if args.size is None:
+    args.size = len(args.solution[0]) if args.solution else 2
+  if not 2 <= args.size <= args.batteries:
+    ap.error('--size must be between 2 and --batteries')
+  if args.solution and not fits(
+    args.solution, args.batteries, len(args.solution[0])
+  ):
+    ap.error(f'--solution uses more than {args.batteries} batteries')
+  if args.solution and not fits(args.solution, args.batteries, args.size):
+    ap.error(f'--solution tests are not {args.size} batteries each')
 
   return args
 
 
 if __name__ == '__main__':
-  main(**vars(get_args()))
+  profiler.run(main, get_args())
@@ -1,39 +1,153 @@
-#!/usr/bin/env python
-
-import random
+#!/usr/bin/env python3
+#
+# Workers import this just for the move vocabulary and lookups, so importing
+# it is kept nearly free: nothing is built or written at import, the tables
+# are built the first time they're used (see Tables), and the heavier modules
+# are only imported by the functions that need them.
+
+import os
+import sys
+import time
+from array import array
 
 SQUARE = 'g7'
 FILE = 'chess_moves.txt'
-
-def main():
-  print ''
+BIN_FILE = 'chess_moves.bin'
+
+# promotion codes for packed moves, in the order UCI strings sort
+PROMOTIONS = 'bnqr'
+
+# board symmetries for augmentation, as (file,rank) XOR masks: 7 flips the
+# files (a<->h) or ranks (1<->8) and 0 leaves them alone
+SYMMETRIES = {
+  'mirror': (7,0),
+  'color': (0,7),
+  'both': (7,7),
+}
+
+# how many bytes of a games file --encode reads at a time
+ENCODE_CHUNK = 1<<24
+
+OFFSET_TYPE = 'Q'
+
+def main(
+  binary=False,
+  fen=None,
+  perft=None,
+  jobs=None,
+  hash_size=0,
+  encode=None,
+  output=None,
+):
+  if encode:
+    start = time.time()
+    try:
+      (games,moves) = encode_file(encode,output or encode,jobs)
+    except ValueError as e:
+      sys.exit('%s: %s' % (encode,e))
+    secs = time.time()-start
+    print('Encoded %s games, %s moves in %.2fs (%.0f moves/s) to %s.*' % (
+      games,moves,secs,moves/max(secs,1e-9),output or encode,
+    ))
+    return
+  if perft is not None:
+    if not run_perft(perft,fen,jobs,hash_size):
+      sys.exit(1)
+    return
+  if fen:
+    show_legal(fen)
+    return
+  print('')
   sample_moves(SQUARE)
-  print ''
-  all_moves()
-  print ''
+  print('')
+  show_all_moves()
+  print('')
+  save_vocabulary(binary)
 
 def all_moves():
+  """Return [(square, its moves)] for every square, a1 to h8 by rank."""
+
+  return [
+    (sq,Queen(sq).get_moves()+Knight(sq).get_moves()+Pawn(sq).get_moves())
+    for sq in TABLES.SQUARES
+  ]
+
+def show_all_moves():
+
+  import random
 
   moves = []
   s = ''
-  for y in range(0,8):
-    for x in range(0,8):
-      sq = Square(x,y)
-      m = Queen(sq).get_moves()+Knight(sq).get_moves()+Pawn(sq).get_moves()
-      moves.extend(m)
-      s += '%s ' % len(m)
-    s += '\n'
-  print s
+  for (sq,m) in all_moves():
+    moves.extend(m)
+    s += '%s ' % len(m)
+    if sq.x==7:
+      s += '\n'
+  print(s)
 
-  print 'Total: %s' % len(moves)
+  print('Total: %s' % len(moves))
 
-  print ('Examples: '
+  print('Examples: '
       + ','.join([str(random.choice(moves)) for x in range(0,10)])
       +',...'
   )
 
-  with open(FILE,'w') as f:
-    f.write('\n'.join([str(x) for x in sorted(moves)])+'\n')
+def save_vocabulary(binary=False):
+  """
+  Write vocabulary() to FILE, and packed as little-endian uint16s to BIN_FILE
+  if binary, skipping either file if its checksum shows it's unchanged.
+  Returns the paths actually written.
+  """
+
+  codes = vocabulary()
+  files = [(FILE,''.join([code_uci(c)+'\n' for c in codes]).encode('ascii'))]
+  if binary:
+    files.append((BIN_FILE,le_bytes(codes)))
+  return [path for (path,data) in files if write_if_changed(path,data)]
+
+def write_if_changed(path,data):
+  """Write bytes to path unless its sha256 already matches; True if written."""
+
+  import hashlib
+
+  try:
+    with open(path,'rb') as f:
+      if hashlib.sha256(f.read()).digest()==hashlib.sha256(data).digest():
+        return False
+  except FileNotFoundError:
+    pass
+  with open(path,'wb') as f:
+    f.write(data)
+  return True
+
+def load_codes(path=BIN_FILE):
+  """Read packed moves written by save_vocabulary() into an array('H')."""
+
+  return read_array(path,'H')
+
+def le_bytes(values):
+
+  if sys.byteorder=='big':
+    values = array(values.typecode,values)
+    values.byteswap()
+  return values.tobytes()
+
+def write_array(f,values):
+  """Write an array or numpy array to f little-endian."""
+
+  if hasattr(values,'dtype'):
+    values.astype(values.dtype.newbyteorder('<')).tofile(f)
+  else:
+    f.write(le_bytes(values))
+
+def read_array(path,typecode):
+
+  values = array(typecode)
+  with open(path,'rb') as f:
+    values.fromfile(f,os.fstat(f.fileno()).st_size//values.itemsize)
+  if sys.byteorder=='big':
+    values.byteswap()
+  return values
 
 def sample_moves(sq):
 
@@ -42,14 +156,22 @@ def sample_moves(sq):
   k = Knight(s).get_moves()
   p = Pawn(s).get_moves()
   moves = q+k+p
-  print '%s Moves: %s' % (s,len(moves))
+  print('%s Moves: %s' % (s,len(moves)))
   show_moves(s,moves)
-  print 'Knight: '+','.join([str(x) for x in k])
-  print 'Pawn: '+','.join([str(x) for x in p])
+  print('Knight: '+','.join([str(x) for x in sorted(k)]))
+  print('Pawn: '+','.join([str(x) for x in p]))
+
+def show_legal(fen):
+
+  pos = Position(fen)
+  codes = pos.legal_moves()
+  print('%s Legal moves: %s' % (pos.fen(),len(codes)))
+  for code in sorted(codes):
+    print('%s %s' % (code_uci(code),INDEX.code_id(code)))
 
 def show_moves(piece,moves):
 
-  squares = [move.other(piece) for move in moves]
+  squares = set([move.other(piece) for move in moves])
   s = '+-----------------+\n'
   for y in range(7,-1,-1):
     s += '| '
@@ -63,9 +185,17 @@ def show_moves(piece,moves):
         s += '. '
     s += '|\n'
   s += '+-----------------+'
-  print s
+  print(s)
 
 class Square(object):
+  """
+  There are only ever 64 of these, one per square, built once on first use.
+  Square() looks one up by name or (x,y) rather than making a new one, so
+  squares compare and hash by identity. Each knows its bitboard index i
+  (y*8+x).
+  """
+
+  __slots__ = ('x','y','i','name')
 
   @staticmethod
   def valid(s):
@@ -77,26 +207,51 @@ class Square(object):
 
     return '%s%s' % ('abcdefgh'[x],y+1)
 
+  @staticmethod
+  def index(a1):
+    """Return the file-major index of a1 used by packed moves."""
+
+    if len(a1)!=2 or a1[0] not in 'abcdefgh' or a1[1] not in '12345678':
+      raise ValueError('invalid square "%s"' % a1)
+    return 'abcdefgh'.index(a1[0])*8+int(a1[1])-1
+
   @staticmethod
   def xy(a1):
 
-    return ('abcdefg'.index(a1[0]),int(a1[1])-1)
+    return ('abcdefgh'.index(a1[0]),int(a1[1])-1)
+
+  @staticmethod
+  def at(i):
+
+    return TABLES.SQUARES[i]
+
+  @classmethod
+  def _make(cls,i):
+
+    self = object.__new__(cls)
+    (self.x,self.y,self.i) = (i%8,i//8,i)
+    self.name = Square.a1(self.x,self.y)
+    return self
 
-  def __init__(self,*args):
+  def __new__(cls,*args):
 
     if len(args)==1:
-      vals = Square.xy(args[0])
-    else:
-      vals = args
-    (self.x,self.y) = vals
+      try:
+        return TABLES.SQUARE_NAMES[args[0]]
+      except KeyError:
+        raise ValueError('invalid square "%s"' % args[0])
+    (x,y) = args
+    if not (0<=x<8 and 0<=y<8):
+      raise ValueError('square (%s,%s) is off the board' % (x,y))
+    return TABLES.SQUARES[y*8+x]
 
-  def __eq__(self,other):
+  def __reduce__(self):
 
-    return self.x==other.x and self.y==other.y
+    return (Square,(self.name,))
 
   def __str__(self):
 
-    return Square.a1(self.x,self.y)
+    return self.name
 
   __repr__ = __str__
 
@@ -116,6 +271,29 @@ class Move(object):
     if self.p and self.p not in 'rnbq':
       raise ValueError('invalid promotion "%s"' % self.p)
 
+  @staticmethod
+  def decode(code):
+
+    (a,b,p) = (code>>9,code>>3&63,code&7)
+    return Move(
+      Square(a//8,a%8),
+      Square(b//8,b%8),
+      PROMOTIONS[p-1] if p else None,
+    )
+
+  def encode(self):
+    """
+    Pack into 15 bits as from (6), to (6), promotion (3). Squares are packed
+    file-major (a1=0, a2=1, ..., h8=63) and promotions in PROMOTIONS order
+    after none, so packed moves sort exactly like their UCI strings.
+    """
+
+    return (
+      (self.a.x*8+self.a.y)<<9
+      | (self.b.x*8+self.b.y)<<3
+      | (PROMOTIONS.index(self.p)+1 if self.p else 0)
+    )
+
   def other(self,sq):
 
     if sq==self.a:
@@ -129,7 +307,7 @@ class Move(object):
 
   def __lt__(self,other):
 
-    return str(self)<str(other)
+    return self.encode()<other.encode()
 
   def __contains__(self,x):
 
@@ -143,10 +321,59 @@ class Move(object):
 
   def __hash__(self):
 
-    return hash(str(self))
+    return self.encode()
+
+# Bitboards: bit (y*8+x) is set for each square (x,y) in the set, so a1 is
+# bit 0, h1 is bit 7 and h8 is bit 63. Each attack table has one bitboard per
+# square of everywhere a piece there could move on an otherwise empty board.
+
+KNIGHT_STEPS = [(-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)]
+KING_STEPS = [(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)]
+ROOK_STEPS = [(-1,0),(1,0),(0,-1),(0,1)]
+BISHOP_STEPS = [(-1,-1),(-1,1),(1,-1),(1,1)]
+
+def attack_table(steps,slide=False):
+
+  table = []
+  for i in range(0,64):
+    bb = 0
+    for (dx,dy) in steps:
+      (x,y) = (i%8+dx,i//8+dy)
+      while 0<=x<8 and 0<=y<8:
+        bb |= 1<<(y*8+x)
+        if not slide:
+          break
+        (x,y) = (x+dx,y+dy)
+    table.append(bb)
+  return table
+
+def promotion_table():
+
+  # a pawn on the 2nd or 7th rank promotes by pushing or capturing onto the
+  # 1st or 8th (we don't care which color it is)
+  table = []
+  for i in range(0,64):
+    (x,y) = (i%8,i//8)
+    bb = 0
+    if y in [1,6]:
+      y = {1:0,6:7}[y]
+      for nx in range(max(x-1,0),min(x+2,8)):
+        bb |= 1<<(y*8+nx)
+    table.append(bb)
+  return table
+
+def bits(bb):
+  """Yield the index of each set bit in bb, lowest first."""
+
+  while bb:
+    low = bb & -bb
+    yield low.bit_length()-1
+    bb ^= low
 
 class Piece(object):
 
+  ATTACKS = None  # name of the table in TABLES
+
   def __init__(self,square):
 
     self.s = square
@@ -155,62 +382,938 @@ class Piece(object):
 
   def get_moves(self):
 
-    return [Move(Square(self.x,self.y),s) for s in self.get_squares()]
+    return [Move(self.s,s) for s in self.get_squares()]
 
   def get_squares(self):
 
-    return [s for s in self.get() if Square.valid(s)]
+    return [TABLES.SQUARES[i] for i in bits(self.get())]
 
   def get(self):
 
-    raise NotImplementedError
+    return getattr(TABLES,self.ATTACKS)[self.s.i]
 
 class Queen(Piece):
 
-  def get(self):
-
-    moves = []
-    for i in range(0,8):
-      if i!=self.x:
-        moves.append(Square(i,self.y))
-        moves.append(Square(i,self.y-self.x+i))
-        moves.append(Square(i,self.y+self.x-i))
-      if i!=self.y:
-        moves.append(Square(self.x,i))
-    return moves
+  ATTACKS = 'QUEEN_RAYS'
 
 class Knight(Piece):
 
-  MOVES = [(-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)]
-
-  def get(self):
-
-    moves = []
-    for (x,y) in Knight.MOVES:
-      moves.append(Square(self.x+x,self.y+y))
-    return moves
+  ATTACKS = 'KNIGHT_ATTACKS'
 
 class Pawn(Piece):
 
-  def get(self):
-
-    if self.y not in [1,6]:
-      return []
-    y = {1:0,6:7}[self.y]
-
-    moves = []
-    for i in range(self.x-1,self.x+2):
-      moves.append(Square(i,y))
-    return moves
+  ATTACKS = 'PROMOTION_TARGETS'
 
   def get_moves(self):
 
     moves = []
     for sq in self.get_squares():
       for p in 'rnbq':
-        me = Square(self.x,self.y)
-        moves.append(Move(me,sq,p))
+        moves.append(Move(self.s,sq,p))
     return moves
 
+def vocabulary():
+  """Return every move all_moves() finds as sorted packed codes."""
+
+  (t,fm) = (TABLES,TABLES.FILE_MAJOR)
+  codes = []
+  for i in range(0,64):
+    a = fm[i]
+    for j in bits(t.QUEEN_RAYS[i]|t.KNIGHT_ATTACKS[i]):
+      codes.append(a<<9|fm[j]<<3)
+    for j in bits(t.PROMOTION_TARGETS[i]):
+      for p in range(1,len(PROMOTIONS)+1):
+        codes.append(a<<9|fm[j]<<3|p)
+  return array('H',sorted(codes))
+
+def uci_code(uci):
+  """Return the packed code for a UCI move string, or raise ValueError."""
+
+  if len(uci) not in (4,5):
+    raise ValueError('invalid move "%s"' % uci)
+  try:
+    return (
+      Square.index(uci[0:2])<<9
+      | Square.index(uci[2:4])<<3
+      | (PROMOTIONS.index(uci[4])+1 if len(uci)==5 else 0)
+    )
+  except ValueError:
+    raise ValueError('invalid move "%s"' % uci)
+
+def code_uci(code):
+
+  (a,b,p) = (code>>9,code>>3&63,code&7)
+  (squares,fm) = (TABLES.SQUARES,TABLES.FILE_MAJOR)
+  return '%s%s%s' % (
+    squares[fm[a]].name,
+    squares[fm[b]].name,
+    PROMOTIONS[p-1] if p else '',
+  )
+
+class MoveIndex(object):
+  """
+  Read-only lookups between the ids of moves (their line in chess_moves.txt,
+  from 0), their UCI strings and their packed codes, all O(1). The tables
+  are only built on first use. They're two flat arrays with no per-move
+  objects, so forked workers share them without copying pages.
+  """
+
+  __slots__ = ('_codes','_ids','_tokens','_symmetries')
+
+  def __init__(self):
+
+    self._codes = None
+    self._ids = None
+    self._tokens = None
+    self._symmetries = {}
+
+  def _load(self):
+
+    codes = vocabulary()
+    ids = array('h',[-1])*(1<<15)  # direct-address table over every code
+    for (i,code) in enumerate(codes):
+      ids[code] = i
+    (self._codes,self._ids) = (codes,ids)
+
+  @property
+  def codes(self):
+
+    if self._codes is None:
+      self._load()
+    return self._codes
+
+  @property
+  def ids(self):
+
+    if self._ids is None:
+      self._load()
+    return self._ids
+
+  @property
+  def tokens(self):
+    """{UCI bytes: id} for matching moves in raw file data."""
+
+    if self._tokens is None:
+      self._tokens = dict(
+        (code_uci(code).encode('ascii'),i)
+        for (i,code) in enumerate(self.codes)
+      )
+    return self._tokens
+
+  def __len__(self):
+
+    return len(self.codes)
+
+  def __contains__(self,uci):
+
+    try:
+      self.id(uci)
+    except KeyError:
+      return False
+    return True
+
+  def id(self,uci):
+
+    try:
+      code = uci_code(uci)
+    except ValueError:
+      raise KeyError(uci)
+    return self.code_id(code)
+
+  def code_id(self,code):
+
+    ids = self.ids
+    if not 0<=code<len(ids) or ids[code]<0:
+      raise KeyError(code)
+    return ids[code]
+
+  def code(self,i):
+
+    return self.codes[i]
+
+  def uci(self,i):
+
+    return code_uci(self.codes[i])
+
+  def symmetry(self,name):
+    """
+    Return an array('H') permutation of move ids under one of SYMMETRIES,
+    so perm[i] is the id of move i mirrored and/or color flipped. Every
+    piece's moves are symmetric under both, so this is a true permutation.
+    Squares are file-major in packed codes, so a symmetry is one XOR of each
+    square's file and rank bits.
+    """
+
+    if name not in self._symmetries:
+      (files,ranks) = SYMMETRIES[name]
+      mask = files<<3|ranks
+      mask = mask<<9|mask<<3
+      (codes,ids) = (self.codes,self.ids)
+      self._symmetries[name] = array('H',[ids[c^mask] for c in codes])
+    return self._symmetries[name]
+
+  def transform(self,ids,name):
+    """Map a batch of move ids under a symmetry with one gather."""
+
+    perm = self.symmetry(name)
+    if hasattr(ids,'dtype'):
+      np = TABLES.numpy
+      return np.frombuffer(perm,dtype=np.uint16)[ids]
+    return array('H',[perm[i] for i in ids])
+
+INDEX = MoveIndex()
+
+# Sliding attacks with blockers. Only the occupancy of a slider's relevant
+# squares (its rays minus the last square of each, which is attacked either
+# way) can change its attacks, so like PEXT/magic tables we index by
+# occupancy & mask. Here the index is just a dict per square, filled in the
+# first time each masked occupancy comes up instead of all up front.
+
+def slider_masks(steps):
+
+  masks = []
+  for i in range(0,64):
+    bb = 0
+    for (dx,dy) in steps:
+      (x,y) = (i%8+dx,i//8+dy)
+      while 0<=x+dx<8 and 0<=y+dy<8:
+        bb |= 1<<(y*8+x)
+        (x,y) = (x+dx,y+dy)
+    masks.append(bb)
+  return masks
+
+def slide(i,occ,steps):
+
+  bb = 0
+  for (dx,dy) in steps:
+    (x,y) = (i%8+dx,i//8+dy)
+    while 0<=x<8 and 0<=y<8:
+      bit = 1<<(y*8+x)
+      bb |= bit
+      if occ & bit:
+        break
+      (x,y) = (x+dx,y+dy)
+  return bb
+
+def rook_attacks(i,occ):
+
+  key = occ & TABLES.ROOK_MASKS[i]
+  try:
+    return TABLES.ROOK_TABLES[i][key]
+  except KeyError:
+    bb = TABLES.ROOK_TABLES[i][key] = slide(i,key,ROOK_STEPS)
+    return bb
+
+def bishop_attacks(i,occ):
+
+  key = occ & TABLES.BISHOP_MASKS[i]
+  try:
+    return TABLES.BISHOP_TABLES[i][key]
+  except KeyError:
+    bb = TABLES.BISHOP_TABLES[i][key] = slide(i,key,BISHOP_STEPS)
+    return bb
+
+def between_table():
+
+  # table[a][b] is the squares strictly between a and b if they share a
+  # rank, file or diagonal, else 0
+  table = [[0]*64 for i in range(0,64)]
+  for i in range(0,64):
+    for (dx,dy) in ROOK_STEPS+BISHOP_STEPS:
+      (x,y) = (i%8+dx,i//8+dy)
+      bb = 0
+      while 0<=x<8 and 0<=y<8:
+        table[i][y*8+x] = bb
+        bb |= 1<<(y*8+x)
+        (x,y) = (x+dx,y+dy)
+  return table
+
+ALL_SQUARES = (1<<64)-1
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+PIECES = ['PNBRQK','pnbrqk']  # by color, then in PIECE_TYPES order
+PIECE_TYPES = 'pnbrqk'
+
+# right: (king from, king to, rook from, squares the king crosses (can't be
+# attacked), squares that must be empty)
+CASTLING = {
+  'K': (4,6,7,(5,6),(5,6)),
+  'Q': (4,2,0,(3,2),(1,2,3)),
+  'k': (60,62,63,(61,62),(61,62)),
+  'q': (60,58,56,(59,58),(57,58,59)),
+}
+# which rights are lost when a piece moves from or to each square
+CASTLING_LOST = {0:'Q',4:'KQ',7:'K',56:'q',60:'kq',63:'k'}
+
+# Zobrist keys: a position's key is the XOR of one random number per piece on
+# each square, castling right, en passant file and black to move, so play()
+# can update it as pieces move instead of rehashing the whole board
+def zobrist_keys(seed,n):
+
+  import random
+
+  rand = random.Random(seed)
+  return [rand.getrandbits(64) for i in range(0,n)]
+
+def import_numpy():
+
+  try:
+    import numpy
+  except ImportError:
+    return None
+  return numpy
+
+class Tables(object):
+  """
+  Every precomputed table, each built by its builder the first time it's
+  looked up and then kept as a plain attribute, so later lookups cost the
+  same as a global. Also reachable as module attributes for callers, e.g.
+  chess_moves.KNIGHT_ATTACKS.
+  """
+
+  def __init__(self,**builders):
+
+    self._builders = builders
+
+  def __getattr__(self,name):
+
+    try:
+      build = self._builders[name]
+    except KeyError:
+      raise AttributeError(name)
+    value = build()
+    setattr(self,name,value)
+    return value
+
+TABLES = Tables(
+  SQUARES=lambda: [Square._make(i) for i in range(0,64)],
+  SQUARE_NAMES=lambda: dict((s.name,s) for s in TABLES.SQUARES),
+  KNIGHT_ATTACKS=lambda: attack_table(KNIGHT_STEPS),
+  KING_ATTACKS=lambda: attack_table(KING_STEPS),
+  ROOK_RAYS=lambda: attack_table(ROOK_STEPS,slide=True),
+  BISHOP_RAYS=lambda: attack_table(BISHOP_STEPS,slide=True),
+  QUEEN_RAYS=lambda: [
+    r|b for (r,b) in zip(TABLES.ROOK_RAYS,TABLES.BISHOP_RAYS)
+  ],
+  PROMOTION_TARGETS=promotion_table,
+  PAWN_ATTACKS=lambda: [  # by color, 0 for white
+    attack_table([(-1,1),(1,1)]),
+    attack_table([(-1,-1),(1,-1)]),
+  ],
+  # bitboard index <-> file-major index (as in packed moves); it's its own
+  # inverse
+  FILE_MAJOR=lambda: [(i%8)*8+i//8 for i in range(0,64)],
+  ROOK_MASKS=lambda: slider_masks(ROOK_STEPS),
+  BISHOP_MASKS=lambda: slider_masks(BISHOP_STEPS),
+  ROOK_TABLES=lambda: [{} for i in range(0,64)],
+  BISHOP_TABLES=lambda: [{} for i in range(0,64)],
+  BETWEEN=between_table,
+  ZOBRIST_PIECES=lambda: dict(
+    (p,zobrist_keys(i,64)) for (i,p) in enumerate(PIECES[0]+PIECES[1])
+  ),
+  ZOBRIST_CASTLING=lambda: dict(zip('KQkq',zobrist_keys(12,4))),
+  ZOBRIST_EP=lambda: zobrist_keys(13,8),
+  ZOBRIST_BLACK=lambda: zobrist_keys(14,1)[0],
+  numpy=import_numpy,
+)
+
+def __getattr__(name):
+
+  return getattr(TABLES,name)
+
+def lsb(bb):
+
+  return (bb & -bb).bit_length()-1
+
+class Position(object):
+  """
+  A position read from and written to FEN, with bitboards per piece (FEN
+  letters, uppercase for white) and per color, plus a mailbox for looking up
+  what's on a square. legal_moves() generates fully legal moves as packed
+  codes (see Move.encode), which are all in the chess_moves.txt vocabulary;
+  code_uci() turns them into the same strings as Move.__str__.
+  """
+
+  __slots__ = (
+    'board','bb','occ','turn','castling','ep','halfmove','fullmove','key',
+  )
+
+  def __init__(self,fen=START_FEN):
+
+    fields = fen.split()
+    if len(fields)==4:
+      fields += ['0','1']
+    if len(fields)!=6:
+      raise ValueError('invalid FEN "%s"' % fen)
+    (rows,turn,castling,ep,halfmove,fullmove) = fields
+
+    self.board = [None]*64
+    rows = rows.split('/')
+    if len(rows)!=8:
+      raise ValueError('invalid FEN "%s"' % fen)
+    for (r,row) in enumerate(rows):
+      x = 0
+      for c in row:
+        if c in '12345678':
+          x += int(c)
+        elif c.lower() in PIECE_TYPES and x<8:
+          self.board[(7-r)*8+x] = c
+          x += 1
+        else:
+          raise ValueError('invalid FEN "%s"' % fen)
+      if x!=8:
+        raise ValueError('invalid FEN "%s"' % fen)
+
+    if turn not in ('w','b') or (castling!='-' and set(castling)-set('KQkq')):
+      raise ValueError('invalid FEN "%s"' % fen)
+    self.turn = 'wb'.index(turn)
+    self.castling = '' if castling=='-' else castling
+    self.ep = None if ep=='-' else Square(ep).i
+    (self.halfmove,self.fullmove) = (int(halfmove),int(fullmove))
+
+    self.bb = dict((p,0) for p in PIECES[0]+PIECES[1])
+    self.occ = [0,0]
+    for (i,p) in enumerate(self.board):
+      if p:
+        self.bb[p] |= 1<<i
+        self.occ[p.islower()] |= 1<<i
+    for p in 'Kk':
+      if bin(self.bb[p]).count('1')!=1:
+        raise ValueError('FEN needs exactly one "%s": "%s"' % (p,fen))
+    if (self.bb['P']|self.bb['p']) & (0xff|0xff<<56):
+      raise ValueError('FEN has a pawn on rank 1 or 8: "%s"' % fen)
+
+    self.key = self.state_key()
+    for (i,p) in enumerate(self.board):
+      if p:
+        self.key ^= TABLES.ZOBRIST_PIECES[p][i]
+
+  def state_key(self):
+    """Return the part of the Zobrist key that isn't pieces."""
+
+    key = TABLES.ZOBRIST_BLACK if self.turn else 0
+    for c in self.castling:
+      key ^= TABLES.ZOBRIST_CASTLING[c]
+    if self.ep is not None:
+      key ^= TABLES.ZOBRIST_EP[self.ep%8]
+    return key
+
+  def fen(self):
+
+    rows = []
+    for y in range(7,-1,-1):
+      (row,empty) = ('',0)
+      for x in range(0,8):
+        p = self.board[y*8+x]
+        if p:
+          row += (str(empty) if empty else '')+p
+          empty = 0
+        else:
+          empty += 1
+      rows.append(row+(str(empty) if empty else ''))
+    return '%s %s %s %s %d %d' % (
+      '/'.join(rows),
+      'wb'[self.turn],
+      self.castling or '-',
+      '-' if self.ep is None else TABLES.SQUARES[self.ep].name,
+      self.halfmove,
+      self.fullmove,
+    )
+
+  __str__ = fen
+
+  def attackers(self,i,color,occ):
+    """Return color's pieces attacking square i when occ is occupied."""
+
+    (p,bb,t) = (PIECES[color],self.bb,TABLES)
+    return (
+      t.PAWN_ATTACKS[1-color][i] & bb[p[0]]
+      | t.KNIGHT_ATTACKS[i] & bb[p[1]]
+      | t.KING_ATTACKS[i] & bb[p[5]]
+      | bishop_attacks(i,occ) & (bb[p[2]]|bb[p[4]])
+      | rook_attacks(i,occ) & (bb[p[3]]|bb[p[4]])
+    )
+
+  def in_check(self):
+
+    king = lsb(self.bb[PIECES[self.turn][5]])
+    return bool(
+      self.attackers(king,1-self.turn,self.occ[0]|self.occ[1])
+    )
+
+  def legal_moves(self):
+    """
+    Return every legal move as a packed code. Rather than trying each move
+    and checking the king afterward, we work out checkers and pinned pieces
+    up front: in double check only the king moves, in single check other
+    pieces must capture the checker or block, and a pinned piece can only
+    move along its pin. En passant is the one move that can expose the king
+    some other way (both pawns leave the rank), so it's tested by playing it.
+    """
+
+    (us,them) = (self.turn,1-self.turn)
+    (p,bb,fm,between) = (PIECES[us],self.bb,TABLES.FILE_MAJOR,TABLES.BETWEEN)
+    (ours,theirs) = (self.occ[us],self.occ[them])
+    occ = ours|theirs
+    king = lsb(bb[p[5]])
+    codes = []
+    add = codes.append
+
+    without_king = occ ^ 1<<king
+    for to in bits(TABLES.KING_ATTACKS[king] & ~ours):
+      if not self.attackers(to,them,without_king):
+        add(fm[king]<<9|fm[to]<<3)
+
+    checkers = self.attackers(king,them,occ)
+    if checkers & checkers-1:
+      return codes
+    if checkers:
+      target = checkers|between[king][lsb(checkers)]
+    else:
+      target = ~ours & ALL_SQUARES
+      for right in self.castling:
+        (frm,to,rook,cross,empty) = CASTLING[right]
+        if (
+          right.isupper()==(us==0)
+          and frm==king
+          and self.board[rook]==p[3]
+          and not any(self.board[i] for i in empty)
+          and not any(self.attackers(i,them,occ) for i in cross)
+        ):
+          add(fm[frm]<<9|fm[to]<<3)
+
+    # a pinned piece may only move between the king and its pinner
+    pins = {}
+    t = PIECES[them]
+    snipers = (
+      rook_attacks(king,theirs) & (bb[t[3]]|bb[t[4]])
+      | bishop_attacks(king,theirs) & (bb[t[2]]|bb[t[4]])
+    )
+    for sniper in bits(snipers):
+      blockers = between[king][sniper] & occ
+      if blockers & ours and not blockers & blockers-1:
+        pins[lsb(blockers)] = between[king][sniper]|1<<sniper
+
+    for sq in bits(bb[p[1]]):
+      if sq not in pins:
+        for to in bits(TABLES.KNIGHT_ATTACKS[sq] & target):
+          add(fm[sq]<<9|fm[to]<<3)
+    for (pieces,attacks) in (
+      (bb[p[2]]|bb[p[4]],bishop_attacks),
+      (bb[p[3]]|bb[p[4]],rook_attacks),
+    ):
+      for sq in bits(pieces):
+        for to in bits(attacks(sq,occ) & target & pins.get(sq,ALL_SQUARES)):
+          add(fm[sq]<<9|fm[to]<<3)
+
+    up = 8 if us==0 else -8
+    (start,last) = ((1,7) if us==0 else (6,0))
+    empty = ~occ
+    pawn_attacks = TABLES.PAWN_ATTACKS[us]
+    for sq in bits(bb[p[0]]):
+      tos = pawn_attacks[sq] & theirs
+      if empty>>(sq+up) & 1:
+        tos |= 1<<(sq+up)
+        if sq//8==start and empty>>(sq+up+up) & 1:
+          tos |= 1<<(sq+up+up)
+      for to in bits(tos & target & pins.get(sq,ALL_SQUARES)):
+        code = fm[sq]<<9|fm[to]<<3
+        if to//8==last:
+          for promote in range(1,len(PROMOTIONS)+1):
+            add(code|promote)
+        else:
+          add(code)
+
+      if self.ep is not None and pawn_attacks[sq]>>self.ep & 1:
+        captured = self.ep-up
+        after = occ ^ 1<<sq ^ 1<<captured | 1<<self.ep
+        if not self.attackers(king,them,after) & ~(1<<captured):
+          add(fm[sq]<<9|fm[self.ep]<<3)
+
+    return codes
+
+  def play(self,code):
+    """Return the position after the (legal) packed move code."""
+
+    fm = TABLES.FILE_MAJOR
+    (frm,to,promote) = (fm[code>>9],fm[code>>3&63],code&7)
+    new = object.__new__(Position)
+    board = new.board = list(self.board)
+    bb = new.bb = dict(self.bb)
+    occ = new.occ = list(self.occ)
+    new.key = self.key^self.state_key()
+    zobrist = TABLES.ZOBRIST_PIECES
+
+    def toggle(i,piece):
+      bb[piece] ^= 1<<i
+      occ[piece.islower()] ^= 1<<i
+      new.key ^= zobrist[piece][i]
+
+    piece = board[frm]
+    captured = board[to]
+    if captured:
+      toggle(to,captured)
+    toggle(frm,piece)
+    board[frm] = None
+
+    kind = piece.lower()
+    if kind=='p' and to==self.ep:
+      behind = to-8 if self.turn==0 else to+8
+      captured = board[behind]
+      toggle(behind,captured)
+      board[behind] = None
+    if promote:
+      piece = PROMOTIONS[promote-1]
+      piece = piece if self.turn else piece.upper()
+    if kind=='k' and abs(to-frm)==2:
+      (rook_from,rook_to) = (frm+3,frm+1) if to>frm else (frm-4,frm-1)
+      rook = board[rook_from]
+      toggle(rook_from,rook)
+      toggle(rook_to,rook)
+      (board[rook_from],board[rook_to]) = (None,rook)
+    toggle(to,piece)
+    board[to] = piece
+
+    lost = CASTLING_LOST.get(frm,'')+CASTLING_LOST.get(to,'')
+    new.castling = ''.join(c for c in self.castling if c not in lost)
+    new.ep = (frm+to)//2 if kind=='p' and abs(to-frm)==16 else None
+    new.halfmove = 0 if kind=='p' or captured else self.halfmove+1
+    new.fullmove = self.fullmove+self.turn
+    new.turn = 1-self.turn
+    new.key ^= new.state_key()
+    return new
+
+  def legal_uci(self):
+
+    return [code_uci(code) for code in self.legal_moves()]
+
+  def legal_ids(self):
+    """Return the legal moves as ids into the chess_moves.txt vocabulary."""
+
+    return array('H',[INDEX.code_id(code) for code in self.legal_moves()])
+
+def encode_games(f,ids_out,offsets_out,size=None,chunk=ENCODE_CHUNK):
+  """
+  Encode UCI games, one per line of binary file f (just the next size bytes
+  of it if given), as vocabulary ids. Ids go to ids_out as little-endian
+  uint16s, and offsets_out gets uint64 offsets into them with one more than
+  there are games, so game i is ids[offsets[i]:offsets[i+1]]. Every line is
+  a game, even an empty one, so game i is always line i.
+
+  f is read chunk bytes at a time and each run of whole lines is encoded at
+  once: with numpy, token boundaries and packed codes come from vector ops
+  over the raw bytes and ids from one gather, so no per-move objects are
+  made; without it each line is split and looked up in INDEX.tokens.
+  Returns (games,moves).
+  """
+
+  np = TABLES.numpy
+  encode = _encode_lines if np is None else _encode_lines_np
+  write_array(offsets_out,array(OFFSET_TYPE,[0]))
+  (games,moves,read,rest) = (0,0,0,b'')
+  while True:
+    want = chunk if size is None else min(chunk,size-read)
+    data = f.read(want) if want>0 else b''
+    read += len(data)
+    if data:
+      data = rest+data
+      cut = data.rfind(b'\n')+1
+      (data,rest) = (data[:cut],data[cut:])
+    elif rest.strip():
+      (data,rest) = (rest+b'\n',b'')
+    else:
+      break
+    if not data:
+      continue
+
+    (ids,ends,lines) = encode(data,games+1)
+    write_array(ids_out,ids)
+    if np is None:
+      write_array(offsets_out,array(OFFSET_TYPE,[e+moves for e in ends]))
+    else:
+      write_array(offsets_out,(ends+moves).astype(np.uint64))
+    moves += len(ids)
+    games += lines
+
+  return (games,moves)
+
+def _encode_lines(data,line):
+  """Return (ids, offset of each line's end, lines) for whole lines."""
+
+  (tokens,ids,ends) = (INDEX.tokens,array('H'),[])
+  for (n,text) in enumerate(data.split(b'\n')[:-1]):
+    try:
+      ids.extend([tokens[t] for t in text.split()])
+    except KeyError as e:
+      raise unknown_move(line+n,e.args[0].decode('ascii','replace'))
+    ends.append(len(ids))
+  return (ids,ends,len(ends))
+
+def _encode_lines_np(data,line):
+
+  np = TABLES.numpy
+  buf = np.frombuffer(data,dtype=np.uint8).astype(np.int16)
+  space = buf<=32
+  edges = np.flatnonzero(np.diff(
+    np.concatenate(([True],space,[True])).astype(np.int8)
+  ))
+  (starts,stops) = (edges[0::2],edges[1::2])
+  length = stops-starts
+
+  def char(k):
+    return buf[np.minimum(starts+k,len(buf)-1)]
+
+  codes = np.full(256,-1,dtype=np.int16)
+  for (i,c) in enumerate(PROMOTIONS,1):
+    codes[ord(c)] = i
+  (f0,r0,f1,r1) = (char(0)-97,char(1)-49,char(2)-97,char(3)-49)
+  promote = np.where(length==5,codes[char(4)],0)
+  bad = (length<4)|(length>5)|(promote<0)
+  for v in (f0,r0,f1,r1):
+    bad |= (v<0)|(v>7)
+  code = np.where(bad,0,(f0*8+r0)<<9|(f1*8+r1)<<3|promote)
+  ids = np.frombuffer(INDEX.ids,dtype=np.int16)[code]
+  bad |= ids<0
+
+  newlines = np.flatnonzero(buf==10)
+  if bad.any():
+    i = np.argmax(bad)
+    raise unknown_move(
+      line+int(np.searchsorted(newlines,starts[i])),
+      data[starts[i]:stops[i]].decode('ascii','replace'),
+    )
+  ends = np.searchsorted(starts,newlines)
+  return (ids.astype(np.uint16),ends,len(newlines))
+
+def unknown_move(line,move):
+  """The ValueError for a bad move, keeping line and move for encode_file."""
+
+  e = ValueError('line %d: unknown move "%s"' % (line,move))
+  (e.line,e.move) = (line,move)
+  return e
+
+def _encode_shard(args):
+
+  (path,start,stop,prefix,chunk) = args
+  with open(path,'rb') as f:
+    f.seek(start)
+    with open(prefix+'.ids','wb') as ids_out:
+      with open(prefix+'.offsets','wb') as offsets_out:
+        return encode_games(f,ids_out,offsets_out,stop-start,chunk)
+
+def encode_file(path,prefix,jobs=None,chunk=ENCODE_CHUNK):
+  """
+  Encode the games in path to prefix.ids and prefix.offsets (as in
+  encode_games), splitting it at line boundaries into a shard per process.
+  Returns (games,moves).
+  """
+
+  size = os.path.getsize(path)
+  jobs = jobs or os.cpu_count()
+  bounds = [0]
+  with open(path,'rb') as f:
+    for k in range(1,jobs):
+      if size*k//jobs>bounds[-1]:
+        f.seek(size*k//jobs-1)
+        f.readline()
+        if bounds[-1]<f.tell()<size:
+          bounds.append(f.tell())
+  bounds.append(size)
+
+  shards = [
+    (path,start,stop,'%s.%d' % (prefix,i),chunk)
+    for (i,(start,stop)) in enumerate(zip(bounds,bounds[1:]))
+  ]
+  if len(shards)==1:
+    with open(path,'rb') as f:
+      with open(prefix+'.ids','wb') as ids_out:
+        with open(prefix+'.offsets','wb') as offsets_out:
+          return encode_games(f,ids_out,offsets_out,chunk=chunk)
+
+  from concurrent.futures import ProcessPoolExecutor
+  try:
+    # shards finish in order, so a shard's error can be moved to its line
+    # in the file by the games in the ones before it
+    results = []
+    with ProcessPoolExecutor(len(shards)) as pool:
+      try:
+        for result in pool.map(_encode_shard,shards):
+          results.append(result)
+      except ValueError as e:
+        if not hasattr(e,'line'):
+          raise
+        games = sum(shard_games for (shard_games,_) in results)
+        raise unknown_move(games+e.line,e.move) from None
+
+    # stitch the shards together, shifting each one's offsets past the last
+    import shutil
+    (games,moves) = (0,0)
+    with open(prefix+'.ids','wb') as ids_out:
+      with open(prefix+'.offsets','wb') as offsets_out:
+        write_array(offsets_out,array(OFFSET_TYPE,[0]))
+        for ((_,_,_,shard,_),(shard_games,shard_moves)) in zip(shards,results):
+          with open(shard+'.ids','rb') as f:
+            shutil.copyfileobj(f,ids_out)
+          with open(shard+'.offsets','rb') as f:
+            f.seek(array(OFFSET_TYPE).itemsize)
+            rebase_offsets(f,offsets_out,moves,chunk)
+          games += shard_games
+          moves += shard_moves
+  finally:
+    for (_,_,_,shard,_) in shards:
+      for ext in ('.ids','.offsets'):
+        try:
+          os.remove(shard+ext)
+        except FileNotFoundError:
+          pass
+
+  return (games,moves)
+
+def rebase_offsets(f,out,base,chunk=ENCODE_CHUNK):
+  """Copy the offsets left in f to out plus base, chunk bytes at a time."""
+
+  np = TABLES.numpy
+  size = array(OFFSET_TYPE).itemsize
+  while True:
+    data = f.read(max(chunk//size,1)*size)
+    if not data:
+      break
+    if np is None:
+      offsets = array(OFFSET_TYPE)
+      offsets.frombytes(data)
+      if sys.byteorder=='big':
+        offsets.byteswap()
+      write_array(out,array(OFFSET_TYPE,[o+base for o in offsets]))
+    else:
+      write_array(out,np.frombuffer(data,dtype='<u8')+np.uint64(base))
+
+# (name, FEN, leaf nodes at depth 1, 2, ...) from the chess programming wiki
+PERFT_POSITIONS = [
+  ('start',START_FEN,
+    [20,400,8902,197281,4865609,119060324]),
+  ('kiwipete',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    [48,2039,97862,4085603,193690690]),
+  ('position 3','8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    [14,191,2812,43238,674624,11030083]),
+  ('position 4',
+    'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+    [6,264,9467,422333,15833292]),
+  ('position 5','rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+    [44,1486,62379,2103487,89941194]),
+  ('position 6',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    [46,2079,89890,3894594,164075551]),
+]
+
+def perft(pos,depth,hash_size=0):
+  """
+  Count the leaf nodes of the legal move tree depth plies deep. With
+  hash_size, up to that many (Zobrist key, depth) counts are remembered so
+  subtrees reached again by transposition are only counted once.
+  """
+
+  table = {}
+
+  def count(pos,depth):
+    codes = pos.legal_moves()
+    if depth<=1:
+      return len(codes) if depth else 1
+    if hash_size and (pos.key,depth) in table:
+      return table[(pos.key,depth)]
+    n = 0
+    for code in codes:
+      n += count(pos.play(code),depth-1)
+    if len(table)<hash_size:
+      table[(pos.key,depth)] = n
+    return n
+
+  return count(pos,depth)
+
+def _perft(args):
+
+  (fen,depth,hash_size) = args
+  return perft(Position(fen),depth,hash_size)
+
+def perft_split(pos,depth,jobs=None,hash_size=0):
+  """perft() with each root move's subtree counted in a pool of processes."""
+
+  if depth<2 or jobs==1:
+    return perft(pos,depth,hash_size)
+  args = [
+    (pos.play(code).fen(),depth-1,hash_size) for code in pos.legal_moves()
+  ]
+  from concurrent.futures import ProcessPoolExecutor
+  with ProcessPoolExecutor(jobs) as pool:
+    return sum(pool.map(_perft,args))
+
+def run_perft(depth,fen=None,jobs=None,hash_size=0):
+  """Print perft to depth for fen or else PERFT_POSITIONS; False on a miss."""
+
+  positions = [('custom',fen,[])] if fen else PERFT_POSITIONS
+  ok = True
+  for (name,fen,expected) in positions:
+    start = time.time()
+    nodes = perft_split(Position(fen),depth,jobs,hash_size)
+    secs = time.time()-start
+    if depth>len(expected) or depth==0:
+      check = ''
+    elif nodes==expected[depth-1]:
+      check = ' ok'
+    else:
+      check = ' MISMATCH (expected %s)' % expected[depth-1]
+      ok = False
+    print('%-10s depth %s: %s nodes in %.2fs (%.0f nodes/s)%s' % (
+      name,depth,nodes,secs,nodes/max(secs,1e-9),check,
+    ))
+  return ok
+
+def get_args():
+
+  from argparse import ArgumentParser
+
+  import profiler
+
+  ap = ArgumentParser()
+  ap.add_argument(
+    '-B','--binary',action='store_true',
+    help='also write the moves packed as uint16s to %s' % BIN_FILE,
+  )
+  ap.add_argument(
+    '-f','--fen',
+    help='just list the legal moves in FEN and their vocabulary ids',
+  )
+  ap.add_argument(
+    '-p','--perft',type=int,metavar='DEPTH',
+    help='count move tree leaves to DEPTH for --fen or standard positions',
+  )
+  ap.add_argument(
+    '-j','--jobs',type=int,
+    help='processes for --perft and --encode (default: one per cpu)',
+  )
+  ap.add_argument(
+    '-e','--encode',metavar='GAMES',
+    help='encode a file of UCI games (one per line) as vocabulary ids',
+  )
+  ap.add_argument(
+    '-o','--output',metavar='PREFIX',
+    help='write --encode output to PREFIX.ids and PREFIX.offsets'
+      ' (default: GAMES)',
+  )
+  ap.add_argument(
+    '-H','--hash-size',type=int,default=0,metavar='ENTRIES',
+    help='remember up to ENTRIES --perft subtree counts (default: 0, off)',
+  )
+  profiler.add_arguments(ap)
+
+  args = ap.parse_args()
+  if args.fen:
+    try:
+      Position(args.fen)
+    except ValueError as e:
+      ap.error(str(e))
+  return args
+
 if __name__=='__main__':
-  main()
+  import profiler
+  profiler.run(main,get_args())
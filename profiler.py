@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Shared --profile / --trace-alloc support for the scripts in this repo.
+#
+#   $ ./batteries.py --profile --profile-top 15
+#   $ ./sudoku.py --profile-out sudoku.pstats --collapsed sudoku.folded
+#   $ ./sicp/recursion.py -q --trace-alloc
+#
+# Reports go to stderr so they never mix with a script's own output. The
+# --collapsed file has one "outer;inner;leaf count" line per unique stack,
+# sampled off a CPU timer, and loads directly into flamegraph.pl/speedscope.
+#
+# --trace-alloc needs tracemalloc, so the import is guarded for interpreters
+# without it.
+
+import cProfile
+import os
+import pstats
+import signal
+import sys
+from collections import Counter
+
+
+ARGS = ('profile', 'profile_out', 'profile_top', 'collapsed', 'trace_alloc')
+
+
+def add_arguments(ap):
+
+  group = ap.add_argument_group('profiling')
+  add = group.add_argument
+
+  add(
+    '--profile', action='store_true',
+    help='report the hottest functions (cProfile) on stderr',
+  )
+  add(
+    '--profile-out', metavar='PATH',
+    help='also save raw pstats to PATH (implies --profile)',
+  )
+  add(
+    '--profile-top', type=int, default=20, metavar='N',
+    help='how many functions/allocation sites to report (default: 20)',
+  )
+  add(
+    '--collapsed', metavar='PATH',
+    help='write sampled collapsed stacks to PATH for flamegraphs',
+  )
+  add(
+    '--trace-alloc', action='store_true',
+    help='report the top allocation sites (tracemalloc) on stderr',
+  )
+
+  return ap
+
+
+def run(main, args):
+  """Call main() with args minus the profiling ones, profiling as asked."""
+
+  kwargs = dict(vars(args))
+  opts = dict((arg, kwargs.pop(arg, None)) for arg in ARGS)
+  top = opts['profile_top'] or 20
+
+  prof = None
+  if opts['profile'] or opts['profile_out']:
+    prof = cProfile.Profile()
+
+  sampler = None
+  if opts['collapsed']:
+    sampler = StackSampler()
+
+  tracemalloc = None
+  if opts['trace_alloc']:
+    try:
+      import tracemalloc
+    except ImportError:
+      sys.exit('--trace-alloc requires python3')
+    tracemalloc.start(25)
+
+  if sampler:
+    sampler.start()
+  if prof:
+    prof.enable()
+  try:
+    return main(**kwargs)
+  finally:
+    if prof:
+      prof.disable()
+    if sampler:
+      sampler.stop()
+
+    # snapshot before any reporting so pstats' own allocations don't show up
+    alloc = None
+    if tracemalloc:
+      alloc = take_alloc(tracemalloc)
+
+    if prof:
+      report_profile(prof, top, opts['profile_out'])
+    if sampler:
+      sampler.write(opts['collapsed'])
+      sys.stderr.write(
+        '\n### %d samples in %d stacks written to %s\n'
+        % (sum(sampler.stacks.values()), len(sampler.stacks), opts['collapsed'])
+      )
+    if alloc:
+      report_alloc(alloc, top)
+
+
+def report_profile(prof, top, path=None):
+
+  if path:
+    prof.dump_stats(path)
+    sys.stderr.write('\n### pstats written to %s\n' % path)
+
+  sys.stderr.write('\n### top %d functions by own time\n' % top)
+  stats = pstats.Stats(prof, stream=sys.stderr)
+  stats.sort_stats('tottime').print_stats(top)
+
+
+def take_alloc(tracemalloc):
+  """Stop tracing and return (snapshot, current bytes, peak bytes)."""
+
+  ignore = (tracemalloc.__file__, __file__, cProfile.__file__, pstats.__file__)
+  snapshot = tracemalloc.take_snapshot().filter_traces(
+    tuple(tracemalloc.Filter(False, path) for path in ignore)
+  )
+  (current, peak) = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return (snapshot, current, peak)
+
+
+def report_alloc(alloc, top):
+
+  (snapshot, current, peak) = alloc
+  sys.stderr.write(
+    '\n### top %d allocation sites (live %.1f KiB, peak %.1f KiB)\n'
+    % (top, current / 1024, peak / 1024)
+  )
+  for stat in snapshot.statistics('lineno')[:top]:
+    sys.stderr.write('  %s\n' % stat)
+
+
+class StackSampler(object):
+  """Sample the interrupted stack on every SIGPROF tick (unix only)."""
+
+  def __init__(self, interval=0.001):
+
+    self.interval = interval
+    self.stacks = Counter()
+
+  def start(self):
+
+    signal.signal(signal.SIGPROF, self._sample)
+    signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+  def stop(self):
+
+    signal.setitimer(signal.ITIMER_PROF, 0, 0)
+    signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+  def write(self, path):
+
+    with open(path, 'w') as f:
+      for (stack, count) in sorted(self.stacks.items()):
+        f.write('%s %d\n' % (stack, count))
+
+  def _sample(self, signum, frame):
+
+    stack = []
+    while frame is not None:
+      code = frame.f_code
+      stack.append('%s (%s:%d)' % (
+        code.co_name,
+        os.path.basename(code.co_filename),
+        code.co_firstlineno,
+      ))
+      frame = frame.f_back
+    self.stacks[';'.join(reversed(stack))] += 1
@@ -14,7 +14,12 @@
 # _invariant quantity_ that remains unchanged from state to state is a powerful
 # way to think about the design of iterative algorithms.
 
+import sys
 from argparse import ArgumentParser
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import profiler
 
 
 def main(base, debug, exponent):
@@ -69,6 +74,8 @@ def get_args():
 
   add('-d', '--debug', action='store_true')
 
+  profiler.add_arguments(ap)
+
   return ap.parse_args()
 
 
@@ -76,4 +83,4 @@ DEBUG = False
 
 
 if __name__ == '__main__':
-  main(**vars(get_args()))
+  profiler.run(main, get_args())
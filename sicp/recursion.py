@@ -1,40 +1,46 @@
 #!/usr/bin/env python3
 #
-# $ ./recursion.py -m -30 -M 30
+# $ ./recursion.py -q -m -400 -M 400 -j base.json
 #
-#   iterative_no_collection :  0.000079687684774 sec
-#   iterative_deque_maxlen  :  0.000142939388752 sec
-#   iterative_dict          :  0.000156778842211 sec
-#   iterative_list          :  0.000160545110703 sec
-#   iterative_deque         :  0.000170182436705 sec
-#   recursive_caching       :  0.000232491642237 sec
-#   iterative_deque_caching :  0.000422552227974 sec
-#   recursive               : 12.339210778474808 sec
+#   batch_sweep             : 0.000363516 sec  (iqr 0.000049263, min 0.000180704)
+#   iterative_no_collection : 0.015208095 sec  (iqr 0.000814095, min 0.009099743)
+#   iterative_deque_maxlen  : 0.023669097 sec  (iqr 0.010072131, min 0.013659216)
+#   iterative_list          : 0.024810260 sec  (iqr 0.010967784, min 0.013659784)
+#   iterative_deque         : 0.031048393 sec  (iqr 0.014559802, min 0.016601988)
+#   iterative_dict          : 0.033783027 sec  (iqr 0.001878885, min 0.018332541)
+#   matrix_power            : 0.048936297 sec  (iqr 0.000226081, min 0.026075163)
+#   recursive_caching       : 0.064977404 sec  (iqr 0.031132024, min 0.035090695)
+#   iterative_deque_caching : 0.075263901 sec  (iqr 0.006497096, min 0.035448024)
 #
-# $ ./recursion.py -m -400 -M 400
+# Each time is the median over --repeat sweeps of the whole range (after
+# --warmup untimed ones) with gc off. `-c base.json` reruns and flags any
+# function that got significantly slower, exiting 1 if one did.
 #
-#   iterative_no_collection : 0.01620534434914589 sec
-#   iterative_deque_maxlen  : 0.02222696319222450 sec
-#   iterative_list          : 0.03143409639596939 sec
-#   iterative_deque         : 0.03188804164528847 sec
-#   iterative_dict          : 0.03405065461993218 sec
-#   recursive_caching       : 0.03834217041730881 sec
-#   iterative_deque_caching : 0.04966166242957115 sec
+# _recursive takes about 0.5 sec per sweep of -m -30 -M 25 but 10 sec at -M 30,
+# so it is skipped past n = 25 unless --all is given.
 
 
+import gc
+import json
+import sys
 from argparse import ArgumentParser
 from collections import deque
 from functools import cache
-from math import inf
+from math import comb, floor, inf
+from pathlib import Path
+from statistics import quantiles
 from time import perf_counter
 
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import profiler
 
-def main(all_, min_, max_, quiet):
 
-  times = {
-    func: 0
+def main(all_, min_, max_, quiet, warmup, repeat, json_, compare, alpha):
+
+  funcs = [
+    func
     for (name, func) in globals().items()
     if (
       callable(func)
@@ -42,37 +48,178 @@ def main(all_, min_, max_, quiet):
       and not name.startswith('__')
       and (all_ or max_ <= getattr(func, 'skip_after', inf))
     )
-  }
+  ]
+  ns = range(min_, max_ + 1)
 
   if not quiet:
-    progress = tqdm(total=max_ - min_ + 1)
+    progress = tqdm(total=(warmup + repeat) * len(funcs))
+
+  # every function runs once per round so drift hits them all alike; the
+  # first round checks their answers and the first `warmup` aren't kept
+  samples = {func: [] for func in funcs}
+  for round_ in range(warmup + repeat):
+    for func in funcs:
+      (results, sec) = sweep(func, ns)
+      if round_ == 0:
+        if func is funcs[0]:
+          expected = results
+        check(func, results, funcs[0], expected, min_)
+      if round_ >= warmup:
+        samples[func].append(sec)
+      if not quiet:
+        progress.update()
 
-  for n in range(min_, max_ + 1):
-    results = {}
-    for func in times:
+  if not quiet:
+    progress.close()
+
+  stats = {
+    func.__name__.strip('_'): summarize(sec)
+    for (func, sec) in samples.items()
+  }
+  ranked = sorted(stats, key=lambda name: stats[name]['median'])
+
+  width = max(len(name) for name in stats)
+  fmt = '{:%ds} : {:.9f} sec  (iqr {:.9f}, min {:.9f})' % width
+  for name in ranked:
+    s = stats[name]
+    print(fmt.format(name, s['median'], s['iqr'], s['min']))
+
+  if json_:
+    with open(json_, 'w') as f:
+      json.dump(
+        {
+          'min': min_,
+          'max': max_,
+          'warmup': warmup,
+          'repeat': repeat,
+          'results': stats,
+        },
+        f, indent=2,
+      )
+
+  if compare and regressions(compare, stats, ranked, min_, max_, alpha):
+    sys.exit(1)
+
+
+def sweep(func, ns):
+  """Return ([f(n) for n in ns], seconds) from func, with gc off timing."""
+
+  gc.collect()
+  gc.disable()
+  try:
+    if getattr(func, 'batch', False):
+      return time_it(func, ns)
+
+    (results, total) = ([], 0)
+    for n in ns:
       try:
         func.cache_clear()
       except AttributeError:
         pass
       (result, sec) = time_it(func, n)
-      if results and result != (expected := next(iter(results.values()))):
-        done = [f.__name__ for (f, sec) in times.items() if sec > 0]
-        assert False, '\n'.join((
-          '',
-          f'  observed: f({n}) = {result} from {func.__name__}',
-          f'  expected: f({n}) = {expected} from {", ".join(sorted(done))}',
-        ))
-      results[func] = result
-      times[func] += sec
-    if not quiet:
-      progress.update()
-
-  progress.close()
-
-  longest = max((func.__name__.strip("_") for func in times), key=len)
-  fmt = '{:%ds} : {:.9f} sec' % len(longest)
-  for (func, sec) in sorted(times.items(), key=lambda x: x[1]):
-    print(fmt.format(func.__name__.strip("_"), sec))
+      results.append(result)
+      total += sec
+    return (results, total)
+  finally:
+    gc.enable()
+
+
+def check(func, results, ref, expected, min_):
+
+  if results != expected:
+    i = next(i for (i, r) in enumerate(results) if r != expected[i])
+    assert False, '\n'.join((
+      '',
+      f'  observed: f({min_ + i}) = {results[i]} from {func.__name__}',
+      f'  expected: f({min_ + i}) = {expected[i]} from {ref.__name__}',
+    ))
+
+
+def summarize(samples):
+
+  (q1, med, q3) = (
+    quantiles(samples, n=4, method='inclusive')
+    if len(samples) > 1 else samples * 3
+  )
+  return {
+    'median': med,
+    'iqr': q3 - q1,
+    'min': min(samples),
+    'samples': samples,
+  }
+
+
+def regressions(path, stats, ranked, min_, max_, alpha):
+  """
+  Print how each function's median moved against the baseline saved by
+  --json at path, and return the names whose samples are significantly
+  slower by a one-sided Mann-Whitney test. alpha is split across the
+  functions compared (Bonferroni) so one noisy run out of many doesn't flag.
+  """
+
+  with open(path) as f:
+    base = json.load(f)
+  if (base['min'], base['max']) != (min_, max_):
+    sys.exit(
+      f'{path} is for f({base["min"]}..{base["max"]}), not f({min_}..{max_})'
+    )
+
+  names = [name for name in ranked if name in base['results']]
+  alpha /= max(len(names), 1)
+
+  # an exact test can't give p below 1/C(m + n, m), however the samples fall
+  (m, n) = (len(stats[ranked[0]]['samples']), base['repeat'])
+  if names and 1 / comb(m + n, m) >= alpha:
+    sys.exit(
+      f'{m} against {n} samples can never reach alpha {alpha:.4f} for each'
+      f' of {len(names)} functions; raise --repeat here or in {path}'
+    )
+
+  width = max(len(name) for name in stats)
+  fmt = '{:%ds} : {:+7.1f}%%  p={:.4f}  {}' % width
+  print(f'\nvs {path} (alpha {alpha:.4f} each):')
+  slower = []
+  for name in names:
+    (new, old) = (stats[name], base['results'][name])
+    p_slower = mann_whitney(new['samples'], old['samples'])
+    p_faster = mann_whitney(old['samples'], new['samples'])
+    if p_slower < alpha:
+      slower.append(name)
+      verdict = 'REGRESSION'
+    else:
+      verdict = 'faster' if p_faster < alpha else ''
+    change = 100 * (new['median'] / old['median'] - 1)
+    print(fmt.format(name, change, min(p_slower, p_faster), verdict).rstrip())
+
+  return slower
+
+
+def mann_whitney(x, y):
+  """
+  The exact chance of x ranking at least this far above y if both came from
+  the same distribution, with ties counting half (rounded toward the null).
+  """
+
+  u = sum((a > b) + (a == b) / 2 for a in x for b in y)
+  counts = u_counts(len(x), len(y))
+  return sum(counts[floor(u):]) / comb(len(x) + len(y), len(x))
+
+
+def u_counts(m, n):
+  """
+  How many of the C(m + n, m) rankings of m against n samples give each U,
+  i.e. the coefficients of the Gaussian binomial
+      prod((1 - q^(n + i)) / (1 - q^i) for i in 1..m)
+  kept to degree m * n, which is all of it.
+  """
+
+  counts = [1] + [0] * (m * n)
+  for i in range(1, m + 1):
+    for u in range(m * n, n + i - 1, -1):
+      counts[u] -= counts[u - n - i]
+    for u in range(i, m * n + 1):
+      counts[u] += counts[u - i]
+  return counts
 
 
 def skip_after(limit):
@@ -82,6 +229,13 @@ def skip_after(limit):
   return decorator
 
 
+def batch(func):
+  """Mark a candidate as taking the whole range and returning every f(n)."""
+
+  func.batch = True
+  return func
+
+
 def time_it(func, *args, **kwargs):
 
   start = perf_counter()
@@ -89,7 +243,7 @@ def time_it(func, *args, **kwargs):
   return (result, perf_counter() - start)
 
 
-@skip_after(30)
+@skip_after(25)
 def _recursive(n):
 
   if n < 3:
@@ -182,6 +336,94 @@ def _iterative_no_collection(n):
   return c
 
 
+def _matrix_power(n):
+
+  if n < 3:
+    return n
+
+  # (f(k + 2), f(k + 1), f(k)) = M^k (2, 1, 0) for the companion matrix M
+  return advance((2, 1, 0), n - 2)[0]
+
+
+@batch
+def _batch_sweep(ns):
+
+  return list(values(ns))
+
+
+def values(ns):
+  """
+  Yield f(n) for each n in ascending ns from one forward pass, so a range
+  costs max(ns) steps in all rather than n steps for every n. Gaps longer
+  than JUMP are crossed with advance() instead of stepped through.
+  """
+
+  (k, state) = (2, (2, 1, 0))  # (f(k), f(k - 1), f(k - 2))
+  for n in ns:
+    if n < 3:
+      yield n
+      continue
+    if n < k:
+      raise ValueError(f'ns must be ascending, got {n} after {k}')
+
+    if n - k > JUMP:
+      state = advance(state, n - k)
+    else:
+      (c, b, a) = state
+      for _ in range(n - k):
+        (a, b, c) = (b, c, c + 2 * b + 3 * a)
+      state = (c, b, a)
+    k = n
+    yield state[0]
+
+
+def advance(v, n):
+  """
+  Return M^n v for the companion matrix M, raising M by successive squaring
+  as in exponentiation.exp. The accumulator stays a vector instead of a matrix
+  since powers of M commute.
+  """
+
+  if n == 0:
+    return v
+
+  b = COMPANION
+  while n > 1:
+    if n % 2:
+      v = mat_vec(b, v)
+      n -= 1
+    b = mat_mul(b, b)
+    n //= 2
+
+  return mat_vec(b, v)
+
+
+# longer gaps are cheaper to jump than step; measured around n = 10^3..10^5
+JUMP = 32
+
+COMPANION = (
+  (1, 2, 3),
+  (1, 0, 0),
+  (0, 1, 0),
+)
+
+
+def mat_mul(x, y):
+
+  cols = tuple(zip(*y))
+  return tuple(tuple(dot(row, col) for col in cols) for row in x)
+
+
+def mat_vec(x, v):
+
+  return tuple(dot(row, v) for row in x)
+
+
+def dot(u, v):
+
+  return sum(a * b for (a, b) in zip(u, v))
+
+
 def get_args():
 
   ap = ArgumentParser()
@@ -203,13 +445,37 @@ def get_args():
     '-q', '--quiet', action='store_true',
     help='hide progress bar',
   )
+  add(
+    '-w', '--warmup', type=int, default=1,
+    help='untimed rounds to run first (default: %(default)s)',
+  )
+  add(
+    '-r', '--repeat', type=int, default=10,
+    help='timed rounds to take the median/IQR/min of (default: %(default)s)',
+  )
+  add(
+    '-j', '--json', metavar='PATH', dest='json_',
+    help='also save the results as json to PATH, e.g. for --compare',
+  )
+  add(
+    '-c', '--compare', metavar='PATH',
+    help='compare to results saved by --json and exit 1 on a regression',
+  )
+  add(
+    '--alpha', type=float, default=0.05,
+    help='significance level for all of --compare (default: %(default)s)',
+  )
+
+  profiler.add_arguments(ap)
 
   args = ap.parse_args()
   if args.max_ < args.min_:
     ap.error('--max must be greater than --min')
+  if args.warmup < 0 or args.repeat < 1:
+    ap.error('--warmup must be at least 0 and --repeat at least 1')
 
   return args
 
 
 if __name__ == '__main__':
-  main(**vars(get_args()))
+  profiler.run(main, get_args())
@@ -3,9 +3,13 @@
 # [TODO] fix cages>grid.size in _kk_config_gen()
 # [TODO] make rows/cols Cage objects (also add Cage.unique)
 
+from argparse import ArgumentParser
+from array import array
 from itertools import permutations,combinations
 from functools import reduce
 
+import profiler
+
 def main():
   g = Grid(9).make_sudoku()
   print(g)
@@ -69,6 +73,7 @@ class Grid:
 
     self.cages = []
     self.cage_index = {}
+    self.peers = {}
 
     self.update_queue = set()
 
@@ -85,6 +90,7 @@ class Grid:
     self.cages.append(cage)
     for cell in cage.cells.values():
       self.cage_index[cell.loc] = cage
+    self.peers.clear()
 
     # check for disjoint cells
     cells = cage.cells.values()
@@ -204,11 +210,25 @@ class Grid:
 
     cell = self.rows[row][col]
     cell.value = val
-    for cells in (
-        self.rows[row],
-        self.cols[col],
-        self.cage_index[(row,col)].cells.values()):
-      self.elim(val,cells,cell)
+    self.elim(val,[self.rows[r][c] for (r,c) in self.get_peers(cell.loc)],cell)
+
+  # get every location sharing a row, col or Cage with the given location
+  #   cached per location since the structure doesn't change once built
+  # @param loc (2-tuple)
+  #   #0 (int) row
+  #   #1 (int) col
+  # @return (tuple of 2-tuple) peer locations, not including loc itself
+  def get_peers(self,loc):
+
+    if loc not in self.peers:
+      (row,col) = loc
+      peers = {(row,c) for c in range(self.size)}
+      peers |= {(r,col) for r in range(self.size)}
+      if loc in self.cage_index:
+        peers |= set(self.cage_index[loc].cells)
+      peers.discard(loc)
+      self.peers[loc] = tuple(sorted(peers))
+    return self.peers[loc]
 
   # eliminate a value from a group of cells
   # @param val (str)
@@ -223,6 +243,68 @@ class Grid:
       if cell not in skip and cell.elim(val):
         self.update_queue.add(cell)
 
+  # capture the mutable state of every Cell, row-major, as immutable bytes
+  #   each Cell becomes a one-hot mask of its possibilities over self.chars
+  #   and a value byte (0 if undetermined, else its index in self.chars + 1)
+  #   e.g. a 9x9 snapshot is 81*8 + 81 bytes no matter how far along we are
+  # @return (2-tuple)
+  #   #0 (bytes) packed array('Q') of possibility masks
+  #   #1 (bytes) packed array('B') of values
+  def snapshot(self):
+
+    index = {char:i for (i,char) in enumerate(self.chars)}
+    masks = array('Q')
+    values = array('B')
+    for row in self.rows:
+      for cell in row:
+        mask = 0
+        for char in cell.poss:
+          mask |= 1<<index[char]
+        masks.append(mask)
+        values.append(0 if cell.value is None else index[cell.value]+1)
+    return (masks.tobytes(),values.tobytes())
+
+  # overwrite the state of every Cell with a previous snapshot
+  #   the snapshot itself is never modified so it can be restored repeatedly
+  # @param snap (2-tuple) as returned by snapshot()
+  # @raise ValueError if the snapshot was taken from a different size Grid
+  def restore(self,snap):
+
+    masks = array('Q')
+    masks.frombytes(snap[0])
+    values = array('B',snap[1])
+    if len(masks)!=self.size**2 or len(values)!=self.size**2:
+      raise ValueError('snapshot does not match Grid size %s' % self.size)
+
+    chars = self.chars
+    for (i,(mask,value)) in enumerate(zip(masks,values)):
+      cell = self.rows[i//self.size][i%self.size]
+      cell.poss = {chars[b] for b in range(self.size) if mask>>b&1}
+      cell.value = chars[value-1] if value else None
+    self.update_queue = set()
+    return self
+
+  # fork this Grid so one branch can be explored without touching the other
+  #   Cells and Cages are new, with each Cage bound to the new Cells; only
+  #   the location-based peers and each Cage's possibilities are shared, so
+  #   don't add cages to either Grid after copying
+  # @param snap (2-tuple) [self.snapshot()] state for the new Grid's Cells
+  # @return (Grid)
+  def copy(self,snap=None):
+
+    new = Grid.__new__(Grid)
+    new.size = self.size
+    new.chars = self.chars
+    new.rows = [[Cell(new,cell.loc) for cell in row] for row in self.rows]
+    new.cols = [
+      [new.rows[r][c] for r in range(0,self.size)]
+      for c in range(0,self.size)
+    ]
+    new.cages = [cage.bind(new) for cage in self.cages]
+    new.cage_index = {loc:cage for cage in new.cages for loc in cage.cells}
+    new.peers = self.peers
+    return new.restore(snap or self.snapshot())
+
   # print this grid with nice-looking table-drawing characters
   # @param cages (bool) [True] whether to draw lines
   # @return (str)
@@ -390,6 +472,21 @@ class Cage:
       len(self.cells)
     )
 
+  # @param grid (Grid) a copy of self.grid
+  # @return (Cage) this Cage over grid's Cells at the same locations
+  #   sharing our possibilities rather than generating them again
+  def bind(self,grid):
+
+    new = Cage.__new__(Cage)
+    new.grid = grid
+    new.poss = self.poss
+    new.cells = {}
+    new.rows = {}
+    new.cols = {}
+    for (r,c) in self.cells:
+      new.add_cell(grid.rows[r][c])
+    return new
+
   # @return (Cage) a deep copy of this Cage
   def copy(self):
 
@@ -745,5 +842,12 @@ class Poss:
 # CLI entry point into main()
 ###############################################################################
 
+# @return (Namespace) only the shared profiling options for now
+def get_args():
+
+  ap = ArgumentParser()
+  profiler.add_arguments(ap)
+  return ap.parse_args()
+
 if __name__=='__main__':
-  main()
\ No newline at end of file
+  profiler.run(main,get_args())
\ No newline at end of file